@@ -0,0 +1,30 @@
+"""Microbenchmark of the compiled StateDecoder against Tello.parse_state.
+Run from the repository root: python -m benchmarks.state_parser
+"""
+
+import timeit
+
+from lib.djitellopy import Tello
+from lib.djitellopy.state import StateDecoder
+
+PACKET = ("mid:-1;x:-100;y:-100;z:-100;mpry:0,0,0;pitch:0;roll:0;yaw:0;vgx:0;vgy:0;vgz:0;"
+          "templ:83;temph:85;tof:10;h:0;bat:73;baro:-58.60;time:0;agx:-3.00;agy:-3.00;agz:-1000.00;\r\n")
+NUMBER = 100000
+
+
+def main() -> None:
+    decoder = StateDecoder()
+
+    legacy = Tello.parse_state(PACKET)
+    record = decoder.decode(PACKET)
+    if legacy != record.as_dict():
+        raise Exception("Decoders disagree:\n{}\n{}".format(legacy, record.as_dict()))
+
+    for name, func in (('Tello.parse_state', lambda: Tello.parse_state(PACKET)),
+                       ('StateDecoder.decode', lambda: decoder.decode(PACKET))):
+        best = min(timeit.repeat(func, number=NUMBER, repeat=5))
+        print("{:>20}: {:6.2f} us per packet".format(name, best / NUMBER * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import os
+import argparse
+from config import CONFIG
+from lib.aruco.map_builder import MapBuilder
+
+MAP_PATH = CONFIG['Map']['path']
+
+# Build a marker map offline from recorded flights and/or videos:
+#   python build_map.py --flight flights/20240101_120000 --video survey.mp4
+def main():
+    parser = argparse.ArgumentParser(description="Build a marker map from recorded detections or videos")
+    parser.add_argument('--flight', action='append', default=[], help="flight directory written by the flight recorder")
+    parser.add_argument('--video', action='append', default=[], help="video of the markers")
+    parser.add_argument('--calibration', default='calibration_files/camcalib.npz', help="camera calibration for videos")
+    parser.add_argument('--step', type=int, default=1, help="use every step-th video frame")
+    parser.add_argument('--origin', type=int, default=1, help="id of the origin marker")
+    parser.add_argument('--output', default=MAP_PATH, help="marker map file")
+    args = parser.parse_args()
+
+    if not args.flight and not args.video:
+        parser.error("nothing to build from, give at least one --flight or --video")
+
+    builder = MapBuilder(origin_id=args.origin)
+    for path in args.flight:
+        builder.addRecording(path)
+    if args.video:
+        from lib.aruco import Camera
+        camera = Camera(args.calibration)
+        for path in args.video:
+            builder.addVideo(path, camera, args.step)
+
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    builder.save(args.output)
+
+if __name__ == '__main__':
+    main()
@@ -9,9 +9,77 @@ CONFIG = {
         'board_square_length': 0.04,
         'board_marker_length': 0.02,
         'marker_length': 0.2,
-        'num_markers': 50
+        'num_markers': 50,
+        'detector_preset': 'balanced'
     },
     'Camera': {
-        's_prog': 15
+        's_prog': 15,
+        'calib_check_interval': 1.0,
+        'undistort_mode': 'sparse'
+    },
+    'Tracking': {
+        'enabled': True,
+        'margin': 0.5,
+        'velocity_gain': 2.0,
+        'max_misses': 3,
+        'full_scan_interval': 15
+    },
+    'Pyramid': {
+        'enabled': True,
+        'scales': [1.0, 0.5, 0.25],
+        'min_marker_side': 48,
+        'full_scan_interval': 15
+    },
+    'Recorder': {
+        'enabled': False,
+        'path': 'flights',
+        'chunk_size': 4096
+    },
+    'Fusion': {
+        'outlier_k': 3.0,
+        'min_distance': 0.1
+    },
+    'Map': {
+        'path': 'maps/markers.npz',
+        'min_observations': 3,
+        'rotation_sigma': 0.05,
+        'translation_sigma': 0.02,
+        'outlier_threshold': 6.0
+    },
+    'Estimator': {
+        'gate': 3.0,
+        'gate_floor': 0.05,
+        'rotation_gate': 0.25,
+        'min_gate_samples': 4,
+        'confidence_sigma': 0.01
+    },
+    'Pose': {
+        'ransac': True,
+        'reprojection_error': 4.0
+    },
+    'Filter': {
+        'enabled': True,
+        'process_noise': [1.0, 1.0, 1.0, 2000.0],
+        'position_noise': [0.0025, 0.0025, 0.01, 25.0],
+        'velocity_noise': [0.01, 0.01, 0.01, 100.0],
+        'drone_process_noise': [2000.0, 1.0],
+        'drone_position_noise': [4.0, 0.0004],
+        'video_latency': 0.1,
+        'max_prediction': 1.0,
+        'velocity_scale': 0.1,
+        'velocity_signs': [1, 1],
+        'yaw_sign': -1
+    },
+    'Control': {
+        'rate': 50,
+        'pid_rate': 30,
+        'setpoint_hold': 0.3,
+        'setpoint_decay': 0.2
+    },
+    'Graph': {
+        'nodes': 'assets/nodes.txt',
+        'edges': 'assets/edges.txt',
+        'scale': 100,
+        'speed': 50
     }
 }
\ No newline at end of file
@@ -2,5 +2,7 @@ from .transformations import *
 from .pid import PID
 from .camera import Camera
 from .controller import Controller
+from .marker_map import MarkerMap
+from .marker_class import Markers
 
 __all__ =["Controller"]
\ No newline at end of file
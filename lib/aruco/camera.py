@@ -6,6 +6,10 @@ import time
 from timeit import default_timer as timer
 from config import CONFIG
 from .aruco_dict import ARUCO_DICT
+from .undistort import Undistorter
+from .detector import DetectorFactory
+from .pyramid import PyramidDetector
+from .pose import PoseEstimator
 
 ARUCO_TYPE = cv2.aruco.getPredefinedDictionary(ARUCO_DICT[CONFIG['Aruco']['type']])
 BOARD_COLS = CONFIG['Aruco']['board_cols']
@@ -15,13 +19,15 @@ BOARD_WIDTH = CONFIG['Aruco']['board_width']
 BOARD_SQUARE_LENGTH = CONFIG['Aruco']['board_square_length']
 BOARD_MARKER_LENGTH = CONFIG['Aruco']['board_marker_length']
 MARKER_LENGTH = CONFIG['Aruco']['marker_length']
+DETECTOR_PRESET = CONFIG['Aruco']['detector_preset']
 
 S_PROG = CONFIG['Camera']['s_prog']
+UNDISTORT_MODE = CONFIG['Camera']['undistort_mode']
 
 board = cv2.aruco.CharucoBoard((BOARD_COLS, BOARD_ROWS), BOARD_SQUARE_LENGTH, BOARD_MARKER_LENGTH, ARUCO_TYPE)
 
 class Camera():
-    def __init__(self, cam_data):
+    def __init__(self, cam_data, undistort_mode=UNDISTORT_MODE, preset=DETECTOR_PRESET):
         self.font = cv2.FONT_HERSHEY_SIMPLEX
         self.cam_data = cam_data
 
@@ -41,14 +47,25 @@ class Camera():
         self.ids_all = []
         self.image_size = None
 
-        self.not_loaded = True
+        self.undistorter = Undistorter(cam_data)
+        # 'full' warps every frame, 'sparse' detects on the raw frame and only undistorts the corners
+        self.undistort_mode = undistort_mode
+
+        self.detectors = DetectorFactory(ARUCO_TYPE, board, preset)
+        self.pyramid = PyramidDetector()
+        self.pose = PoseEstimator(MARKER_LENGTH)
+        self.last_detection = ([], [], None, None)
+
+    # Switch the DetectorParameters preset ('fast', 'balanced' or 'accurate')
+    def setPreset(self, preset):
+        self.detectors.setPreset(preset)
 
     def calibrate(self, frame):
         if not self.calib:
             gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
             
-            arucoDetector = cv2.aruco.ArucoDetector(dictionary=ARUCO_TYPE)
-            charucoDetector = cv2.aruco.CharucoDetector(board)
+            arucoDetector = self.detectors.getArucoDetector()
+            charucoDetector = self.detectors.getCharucoDetector()
 
             corners, ids, _ = arucoDetector.detectMarkers(gray)
 
@@ -89,49 +106,84 @@ class Camera():
                                                                                                        imageSize=self.image_size, 
                                                                                                        cameraMatrix=None, 
                                                                                                        distCoeffs=None)
-                h, w = frame.shape[:2]
-                self.newcameramtx, self.roi=cv2.getOptimalNewCameraMatrix(self.mtx,self.dist,(w,h),1,(w,h))
                 np.savez("./calibration_files/camcalib", ret=ret, mtx=self.mtx, dist=self.dist, rvecs=self.rvecs, tvecs=self.tvecs)
+                self.undistorter.setCalibration(self.mtx, self.dist)
             
-            frame = cv2.undistort(frame, self.mtx, self.dist, None, self.newcameramtx)
-            x,y,w,h = self.roi
-            frame = frame[y:y+h, x:x+w]
+            frame = self.undistorter.undistort(frame)
             cv2.putText(frame, "Camera calibrated.", (0,64), self.font, 1, (0,255,0),2,cv2.LINE_AA)
 
         return frame
     
-    def detect(self, frame):
-        if self.not_loaded:
-            with np.load(self.cam_data) as X:
-                self.mtx = X['mtx']
-                self.dist = X['dist']
-            self.not_loaded=False
-
+    def detect(self, frame, draw=True, roi=None):
+        if self.undistort_mode == 'full':
+            frame = self.undistorter.undistort(frame)
+        else:
+            self.undistorter.load()
+        self.mtx = self.undistorter.mtx
+        self.dist = self.undistorter.dist
         h, w = frame.shape[:2]
-        newcameramtx, roi=cv2.getOptimalNewCameraMatrix(self.mtx,self.dist,(w,h),1,(w,h))
-
-        frame = cv2.undistort(frame, self.mtx, self.dist, None, newcameramtx)
-
-        x,y,w,h = roi
-        frame = frame[y:y+h, x:x+w]
 
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
 
-        arucoDetector = cv2.aruco.ArucoDetector(dictionary=ARUCO_TYPE)
-        corners, ids, _ = arucoDetector.detectMarkers(gray)
+        arucoDetector = self.detectors.getArucoDetector()
+        if roi is None:
+            corners, ids = self.pyramid.detect(arucoDetector, gray)
+        else:
+            # only search the window, then shift the corners back into frame coordinates
+            x,y,rw,rh = roi
+            corners, ids = self.pyramid.detect(arucoDetector, gray[y:y+rh, x:x+rw])
+            offset = np.array([x, y], dtype=np.float32)
+            corners = tuple(c + offset for c in corners)
 
         id_list=[]
         rvecs = []
         tvecs = []
 
         if np.all(ids != None):
-            rvecs, tvecs, _ = cv2.aruco.estimatePoseSingleMarkers(corners, MARKER_LENGTH, self.mtx, self.dist)
-
             for i in range(0, ids.size):
-                cv2.drawFrameAxes(frame, self.mtx, self.dist, rvecs[i], tvecs[i], 0.1)
-                
                 id_list.append(ids[i][0])
 
-            cv2.aruco.drawDetectedMarkers(frame, corners, ids=ids)
+            pose_corners, mtx, dist = self.getPoseInputs(corners)
+            rvecs, tvecs = self.pose.estimateMarkers(id_list, pose_corners, mtx, dist)
+
+            if draw:
+                self.drawOverlay(frame, corners, ids, rvecs, tvecs)
+        else:
+            pose_corners = []
+            mtx, dist = self.getFrameModel()
+            self.pose.previous = {}
+
+        # kept for locate, so corners are undistorted only once per frame
+        self.last_detection = (id_list, pose_corners, mtx, dist)
 
         return frame, id_list, rvecs, tvecs, corners, w, h
+
+    # Corners and camera model to estimate poses with, undistorted corners need no distortion model
+    def getPoseInputs(self, corners):
+        if self.undistort_mode == 'full':
+            # the frame was remapped to the new camera matrix of the undistortion
+            return corners, self.undistorter.new_mtx, self.undistorter.zero_dist
+        return self.undistorter.undistortCorners(corners), self.mtx, self.undistorter.zero_dist
+
+    # Camera model of the frame as it was detected on
+    def getFrameModel(self):
+        if self.undistort_mode == 'full':
+            return self.undistorter.new_mtx, self.undistorter.zero_dist
+        return self.mtx, self.dist
+
+    # Camera position in global coordinates of the last detected frame, from a
+    # single solve over all its markers that are usable in a MarkerMap
+    def locate(self, marker_map, allow_limit):
+        id_list, pose_corners, mtx, dist = self.last_detection
+        return self.pose.estimateCamera(id_list, pose_corners, marker_map, allow_limit, mtx, dist)
+
+    # Draw the detected markers and their axes on the frame
+    def drawOverlay(self, frame, corners, ids, rvecs, tvecs):
+        # the overlay is drawn on the frame as it was detected on, so the raw
+        # distortion model still applies when projecting the axes in sparse mode
+        mtx, dist = self.getFrameModel()
+        for i in range(0, ids.size):
+            cv2.drawFrameAxes(frame, mtx, dist, rvecs[i], tvecs[i], 0.1)
+
+        cv2.aruco.drawDetectedMarkers(frame, corners, ids=ids)
+        return frame
@@ -1,17 +1,40 @@
 import math
+import time
+import threading
 import cv2
 import numpy as np
 from . import Camera
 from . import transformations
 from . import PID
+from .tracker import MarkerTracker
+from .filter import PoseFilter
+from config import CONFIG
 from timeit import default_timer as timer
 
 ERROR = 0.15
+TRACKING = CONFIG['Tracking']['enabled']
+
+FILTERING = CONFIG['Filter']['enabled']
+PROCESS_NOISE = CONFIG['Filter']['process_noise']
+POSITION_NOISE = CONFIG['Filter']['position_noise']
+VELOCITY_NOISE = CONFIG['Filter']['velocity_noise']
+DRONE_PROCESS_NOISE = CONFIG['Filter']['drone_process_noise']
+DRONE_POSITION_NOISE = CONFIG['Filter']['drone_position_noise']
+VIDEO_LATENCY = CONFIG['Filter']['video_latency']
+MAX_PREDICTION = CONFIG['Filter']['max_prediction']
+# Tello vgy and vgx to m/s along the camera x and z axes
+VELOCITY_SCALE = CONFIG['Filter']['velocity_scale']
+VELOCITY_SIGNS = CONFIG['Filter']['velocity_signs']
+YAW_SIGN = CONFIG['Filter']['yaw_sign']
+
+# the PID gains were tuned with one step per detected frame
+PID_PERIOD = 1. / CONFIG['Control']['pid_rate']
 
 class Controller:
-    def __init__(self, S, dir_queue, navigate_event):
+    def __init__(self, S, setpoint, navigate_event):
         self.font = cv2.FONT_HERSHEY_SIMPLEX
-        self.dir_queue = dir_queue
+        # pipeline.SetpointMailbox read by the control loop
+        self.setpoint = setpoint
         self.navigate_event = navigate_event
 
         self.camera = Camera('calibration_files/camcalib.npz')
@@ -21,16 +44,62 @@ class Controller:
         self.t_lost = 1
         self.last_marker_pos = 1
         
-        self.yaw_pid = PID(0.1, 0.00001, 0.001)
-        self.v_pid = PID(0.5, 0.00001, 0.0001)
-        self.vz_pid = PID(0.8, 0.00001, 0.0001)
+        self.yaw_pid = PID(0.1, 0.00001, 0.001, PID_PERIOD)
+        # x and y share the gains but not their integral and previous error
+        self.vx_pid = PID(0.5, 0.00001, 0.0001, PID_PERIOD)
+        self.vy_pid = PID(0.5, 0.00001, 0.0001, PID_PERIOD)
+        self.vz_pid = PID(0.8, 0.00001, 0.0001, PID_PERIOD)
+        # time of the last control() step
+        self.t_control = None
         self.TargetPos = np.array([[0., 0., 1., 0.]])
 
+        # search only near the target while it is being followed
+        self.tracking = TRACKING
+        self.tracker = MarkerTracker()
+        self.frame_size = None
+
+        # optional lib.recorder.FlightRecorder for the detections
+        self.recorder = None
+
+        # marker id -> filter over its tvec (m) and yaw (deg) relative to the camera
+        self.filtering = FILTERING
+        self.filters = {}
+        # detection and control run in different threads
+        self.filter_lock = threading.Lock()
+        # drone yaw (deg) and height above ground (m) from telemetry
+        self.drone_filter = PoseFilter(2, DRONE_PROCESS_NOISE, DRONE_POSITION_NOISE, 1., angles=[0])
+        self.telemetry_seq = None
+
     def calibrate(self, frame):
         return self.camera.calibrate(frame)
 
-    def detect(self, frame):
-        frame, id_list, rvecs, tvecs, corners, w, h = self.camera.detect(frame)
+    # Detect only around the target while following it. The other markers are then
+    # missed, so full frames are searched when not navigating or while recording.
+    def useWindow(self):
+        return (self.tracking and self.frame_size is not None and self.navigate_event.is_set()
+                and self.recorder is None)
+
+    def detect(self, frame, frame_seq=-1):
+        window = None
+        if self.useWindow():
+            window = self.tracker.getWindow(*self.frame_size)
+
+        frame, id_list, rvecs, tvecs, corners, w, h = self.camera.detect(frame, roi=window)
+        self.frame_size = (w, h)
+
+        if self.recorder is not None and len(id_list) > 0:
+            self.recorder.recordDetections(time.time(), frame_seq, id_list, rvecs, tvecs)
+
+        if self.filtering:
+            # the frame shows the scene as it was about one video latency ago
+            t = time.time() - VIDEO_LATENCY
+            with self.filter_lock:
+                for i, marker_id in enumerate(id_list):
+                    self.updateFilter(marker_id, tvecs[i], rvecs[i], t)
+
+        if self.tracking:
+            target = corners[id_list.index(self.TargetID)] if self.TargetID in id_list else None
+            self.tracker.update(target, window is None)
         
         if self.TargetID in id_list:
             index = id_list.index(self.TargetID)
@@ -46,13 +115,13 @@ class Controller:
         if len(id_list) > 0:
             if self.navigate_event.is_set():
                 frame = self.drawCenter(frame, id_list, corners, w, h)
-                directions = self.navigateToTarget(id_list, tvecs, rvecs)
+                directions = self.navigateToTarget(id_list, rvecs, tvecs)
         else:
             if timer()-self.t_lost > 2:
                 if self.last_marker_pos >= 0:
-                    self.dir_queue.put([0, 0, 0, self.speed * 2])
+                    self.setpoint.put([0, 0, 0, self.speed * 2], 'search')
                 else:
-                    self.dir_queue.put([0, 0, 0, -self.speed * 2])
+                    self.setpoint.put([0, 0, 0, -self.speed * 2], 'search')
 
         return frame
 
@@ -60,37 +129,123 @@ class Controller:
         if self.TargetID not in id_list:
             if timer() - self.t_lost > 1:
                 if self.last_marker_pos >= 0:
-                    self.dir_queue.put([0, 0, 0, self.speed * 2])
+                    self.setpoint.put([0, 0, 0, self.speed * 2], 'search')
                 else:
-                    self.dir_queue.put([0, 0, 0, -self.speed * 2])
+                    self.setpoint.put([0, 0, 0, -self.speed * 2], 'search')
         else:
             index = id_list.index(self.TargetID)
             tvec = tvecs[index]
             rvec = rvecs[index]
 
             self.last_marker_pos = tvec[0][0]
-            rvec = transformations.rotationVectorToEulerAngles(rvec) * 180 / math.pi
-        
-            if abs(rvec[0][2]) > 90:
-                rvec[0][1] = -rvec[0][1]
-
-            directions = [0., 0., 0., 0.]
-            A = self.amplify * self.speed
-            
-            err_yaw = rvec[0][1] - self.TargetPos[0][3]
-            directions[3] = self.speed / 2 * self.yaw_pid.control(err_yaw)
-
-            err_x = self.TargetPos[0][0] - tvec[0][0]
-            directions[0] = -A * self.v_pid.control(err_x)
-            err_y = self.TargetPos[0][2] - tvec[0][2]
-            directions[1] = -A * self.v_pid.control(err_y)
-            err_z = self.TargetPos[0][1] - tvec[0][1]
-            directions[2] = A * self.vz_pid.control(err_z)
-
             self.t_lost = timer()
-            self.dir_queue.put(directions)
+
+            if self.filtering:
+                # directions come from the filter at the control rate, see control()
+                return None
+
+            directions = self.getDirections(tvec[0], self.getYaw(rvec))
+            self.setpoint.put(directions, self.TargetID)
             return directions
 
+    # Yaw of the camera relative to a marker in degrees
+    def getYaw(self, rvec):
+        rvec = transformations.rotationVectorToEulerAngles(np.reshape(rvec, (1,3))) * 180 / math.pi
+
+        if abs(rvec[0][2]) > 90:
+            rvec[0][1] = -rvec[0][1]
+        return rvec[0][1]
+
+    # PID velocities towards TargetPos from the target's tvec and yaw, dt seconds
+    # after the previous step or one step per call without dt
+    def getDirections(self, tvec, yaw, dt=None):
+        directions = [0., 0., 0., 0.]
+        A = self.amplify * self.speed
+
+        err_yaw = yaw - self.TargetPos[0][3]
+        directions[3] = self.speed / 2 * self.yaw_pid.control(err_yaw, dt)
+
+        err_x = self.TargetPos[0][0] - tvec[0]
+        directions[0] = -A * self.vx_pid.control(err_x, dt)
+        err_y = self.TargetPos[0][2] - tvec[2]
+        directions[1] = -A * self.vy_pid.control(err_y, dt)
+        err_z = self.TargetPos[0][1] - tvec[1]
+        directions[2] = A * self.vz_pid.control(err_z, dt)
+
+        return directions
+
+    # Add a vision measurement of a marker taken at time t
+    def updateFilter(self, marker_id, tvec, rvec, t):
+        marker_filter = self.filters.get(marker_id)
+        if marker_filter is None:
+            marker_filter = PoseFilter(4, PROCESS_NOISE, POSITION_NOISE, VELOCITY_NOISE, angles=[3])
+            self.filters[marker_id] = marker_filter
+        elif marker_filter.getAge(t) > MAX_PREDICTION:
+            # lost for too long, start over instead of jumping from a stale prediction
+            marker_filter.reset()
+
+        marker_filter.updatePosition(np.append(np.ravel(tvec), self.getYaw(rvec)), t)
+
+    # Add a telemetry record of the drone, a TelloState or state dict
+    def updateTelemetry(self, state):
+        if not state or 'yaw' not in state or 'tof' not in state:
+            return
+        # the same record is read on every control tick until a new packet arrives
+        seq = getattr(state, 'seq', None)
+        if seq is not None and seq == self.telemetry_seq:
+            return
+        self.telemetry_seq = seq
+        t = getattr(state, 'timestamp', time.time())
+
+        with self.filter_lock:
+            self.updateDrone(state, t)
+
+    def updateDrone(self, state, t):
+        self.drone_filter.updatePosition([state['yaw'], state['tof'] / 100], t)
+        _, (yaw_rate, height_rate) = self.drone_filter.predict(t)
+
+        # markers stand still, so they move against the drone in the camera frame
+        velocity = np.array([
+            -VELOCITY_SIGNS[0] * VELOCITY_SCALE * state.get('vgy', 0),
+            height_rate, # the camera y axis points down
+            -VELOCITY_SIGNS[1] * VELOCITY_SCALE * state.get('vgx', 0),
+            YAW_SIGN * yaw_rate
+        ])
+        for marker_filter in self.filters.values():
+            if marker_filter.getAge(t) <= MAX_PREDICTION:
+                marker_filter.updateVelocity(velocity, t)
+
+    # Filtered tvec and yaw of the target predicted to time t, None without a recent sighting
+    def getTarget(self, t):
+        with self.filter_lock:
+            marker_filter = self.filters.get(self.TargetID)
+            if not self.filtering or marker_filter is None or marker_filter.getAge(t) > MAX_PREDICTION:
+                return None
+            position, _ = marker_filter.predict(t)
+        return position[:3], position[3]
+
+    # Velocities for the current moment, to be called at the rate of send_rc_control
+    # Returns None when the target has not been seen recently
+    def control(self, state=None):
+        if state is not None:
+            self.updateTelemetry(state)
+        t = time.time()
+        target = self.getTarget(t)
+        if target is None:
+            return None
+
+        dt = None if self.t_control is None else t - self.t_control
+        if dt is None or dt > MAX_PREDICTION:
+            # following a new sighting, do not carry the integral over
+            self.resetPIDs()
+            dt = PID_PERIOD
+        self.t_control = t
+        return self.getDirections(*target, dt)
+
+    def resetPIDs(self):
+        for pid in (self.yaw_pid, self.vx_pid, self.vy_pid, self.vz_pid):
+            pid.reset()
+
     def drawCenter(self, frame, seen_id_list, corners, w, h):
         if self.TargetID not in seen_id_list:
             pass
@@ -0,0 +1,67 @@
+import cv2
+
+# DetectorParameters overrides, ordered from lowest latency to best accuracy
+DETECTOR_PRESETS = {
+    'fast': {
+        'adaptiveThreshWinSizeMin': 5,
+        'adaptiveThreshWinSizeMax': 15,
+        'adaptiveThreshWinSizeStep': 10,
+        'cornerRefinementMethod': cv2.aruco.CORNER_REFINE_NONE,
+        'minMarkerPerimeterRate': 0.05
+    },
+    'balanced': {
+        'adaptiveThreshWinSizeMin': 3,
+        'adaptiveThreshWinSizeMax': 23,
+        'adaptiveThreshWinSizeStep': 10,
+        'cornerRefinementMethod': cv2.aruco.CORNER_REFINE_NONE,
+        'minMarkerPerimeterRate': 0.03
+    },
+    'accurate': {
+        'adaptiveThreshWinSizeMin': 3,
+        'adaptiveThreshWinSizeMax': 33,
+        'adaptiveThreshWinSizeStep': 5,
+        'cornerRefinementMethod': cv2.aruco.CORNER_REFINE_SUBPIX,
+        'cornerRefinementWinSize': 5,
+        'minMarkerPerimeterRate': 0.01
+    }
+}
+
+class DetectorFactory():
+    def __init__(self, dictionary, board, preset):
+        self.dictionary = dictionary
+        self.board = board
+
+        # detectors are built once and reused for every frame
+        self.aruco_detectors = {}
+        self.charuco_detector = None
+
+        self.setPreset(preset)
+
+    # Build the DetectorParameters for a preset
+    @staticmethod
+    def makeParameters(preset):
+        if preset not in DETECTOR_PRESETS:
+            raise Exception(f"Unknown detector preset: {preset}")
+
+        params = cv2.aruco.DetectorParameters()
+        for key, value in DETECTOR_PRESETS[preset].items():
+            setattr(params, key, value)
+        return params
+
+    # Select the preset used by getArucoDetector
+    def setPreset(self, preset):
+        if preset not in DETECTOR_PRESETS:
+            raise Exception(f"Unknown detector preset: {preset}")
+        self.preset = preset
+
+    def getArucoDetector(self, preset=None):
+        preset = preset or self.preset
+        if preset not in self.aruco_detectors:
+            self.aruco_detectors[preset] = cv2.aruco.ArucoDetector(dictionary=self.dictionary,
+                                                                   detectorParams=self.makeParameters(preset))
+        return self.aruco_detectors[preset]
+
+    def getCharucoDetector(self):
+        if self.charuco_detector is None:
+            self.charuco_detector = cv2.aruco.CharucoDetector(self.board)
+        return self.charuco_detector
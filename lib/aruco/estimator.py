@@ -0,0 +1,78 @@
+import numpy as np
+from scipy.spatial.transform import Rotation
+from config import CONFIG
+
+GATE = CONFIG['Estimator']['gate']
+GATE_FLOOR = CONFIG['Estimator']['gate_floor']
+ROTATION_GATE = CONFIG['Estimator']['rotation_gate']
+MIN_GATE_SAMPLES = CONFIG['Estimator']['min_gate_samples']
+CONFIDENCE_SIGMA = CONFIG['Estimator']['confidence_sigma']
+
+class OriginEstimator():
+    """ Running estimate of every marker's transformation to global, kept in the
+        arrays of a MarkerMap. Translation samples update a Welford mean and
+        covariance, rotation samples a quaternion outer product sum whose main
+        eigenvector is the average rotation. Samples far from the estimate are
+        rejected once a marker has min_gate_samples. Estimates keep improving
+        after the marker became usable.
+    """
+
+    def __init__(self, marker_map, gate=GATE, gate_floor=GATE_FLOOR, rotation_gate=ROTATION_GATE,
+                 min_gate_samples=MIN_GATE_SAMPLES, confidence_sigma=CONFIDENCE_SIGMA):
+        self.map = marker_map
+        # Mahalanobis distance in standard deviations, the covariance is padded by gate_floor (m)
+        self.gate = gate
+        self.gate_floor = gate_floor
+        # angle in radians
+        self.rotation_gate = rotation_gate
+        self.min_gate_samples = min_gate_samples
+        # standard error of the mean (m) at which confidence is 0.5
+        self.confidence_sigma = confidence_sigma
+
+    # Covariance of the translation samples of a row
+    def getCovariance(self, row):
+        n = self.map.allow_use[row]
+        if n < 2:
+            return np.zeros((3,3))
+        return self.map.tvec_m2[row] / (n - 1)
+
+    # Add one sample of a marker's origin and rotation to global
+    # Returns False if it was rejected as an outlier
+    def update(self, row, tvec_sample, dRot_sample):
+        n = self.map.allow_use[row]
+        mean = self.map.tvec_origin[row]
+        q = Rotation.from_matrix(dRot_sample).as_quat()
+
+        if n >= self.min_gate_samples:
+            delta = tvec_sample - mean
+            cov = self.getCovariance(row) + self.gate_floor**2 * np.eye(3)
+            if delta.dot(np.linalg.solve(cov, delta)) > self.gate**2:
+                return False
+            q_mean = Rotation.from_matrix(self.map.dRot[row]).as_quat()
+            if 2*np.arccos(min(abs(q.dot(q_mean)), 1.)) > self.rotation_gate:
+                return False
+
+        # Welford update of the translation
+        n += 1
+        delta = tvec_sample - mean
+        mean += delta / n
+        self.map.tvec_m2[row] += np.outer(delta, tvec_sample - mean)
+        self.map.allow_use[row] = n
+
+        # the average rotation maximizes q^T A q, the sign of q does not matter
+        self.map.quat_acc[row] += np.outer(q, q)
+        _, vectors = np.linalg.eigh(self.map.quat_acc[row])
+        rotation = Rotation.from_quat(vectors[:, -1])
+        self.map.dRot[row] = rotation.as_matrix()
+        self.map.rvec_origin[row] = rotation.as_rotvec()
+
+        self.map.confidence[row] = self.getConfidence(row)
+        return True
+
+    # In (0,1], grows with the number of samples and falls with their spread
+    def getConfidence(self, row):
+        n = self.map.allow_use[row]
+        if n < 2:
+            return 0.
+        mean_variance = np.trace(self.getCovariance(row)) / n
+        return 1 / (1 + mean_variance / self.confidence_sigma**2)
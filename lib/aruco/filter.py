@@ -0,0 +1,117 @@
+import numpy as np
+
+class PoseFilter():
+    """ Constant velocity Kalman filter over n coordinates, the state is the
+        n positions followed by their n velocities. Measurements carry the time
+        they were taken, the filter predicts up to it first. Measurements older
+        than the filter, e.g. video frames arriving after newer telemetry, are
+        moved forward with the estimated velocity. Coordinates listed in angles
+        are in degrees and wrap around at +-180.
+    """
+
+    def __init__(self, dims, process_noise, position_noise, velocity_noise, angles=()):
+        self.dims = dims
+        # acceleration noise density per coordinate
+        self.process_noise = np.broadcast_to(np.asarray(process_noise, dtype=np.float64), (dims,))
+        # measurement variances, one per coordinate or shared
+        self.position_noise = np.broadcast_to(np.asarray(position_noise, dtype=np.float64), (dims,))
+        self.velocity_noise = np.broadcast_to(np.asarray(velocity_noise, dtype=np.float64), (dims,))
+        self.angles = list(angles)
+        self.reset()
+
+    def reset(self):
+        self.x = np.zeros(2*self.dims)
+        self.P = np.eye(2*self.dims)
+        self.t = None
+        # time of the last position measurement
+        self.t_position = None
+
+    def isInitialized(self):
+        return self.t is not None
+
+    # Time since the last position measurement
+    def getAge(self, t):
+        return np.inf if self.t_position is None else t - self.t_position
+
+    def transition(self, dt):
+        n = self.dims
+        F = np.eye(2*n)
+        F[:n, n:] = dt*np.eye(n)
+
+        Q = np.zeros((2*n, 2*n))
+        Q[:n, :n] = np.diag(self.process_noise * dt**3 / 3)
+        Q[:n, n:] = Q[n:, :n] = np.diag(self.process_noise * dt**2 / 2)
+        Q[n:, n:] = np.diag(self.process_noise * dt)
+        return F, Q
+
+    def predictTo(self, t):
+        dt = t - self.t
+        if dt <= 0:
+            return
+        F, Q = self.transition(dt)
+        self.x = F.dot(self.x)
+        self.P = F.dot(self.P).dot(F.T) + Q
+        self.t = t
+        self.wrap(self.x)
+
+    # Position and velocity at time t, the filter itself is not changed
+    def predict(self, t):
+        x = self.x
+        if t > self.t:
+            F, _ = self.transition(t - self.t)
+            x = F.dot(x)
+        x = x.copy()
+        self.wrap(x)
+        return x[:self.dims], x[self.dims:]
+
+    def wrap(self, x):
+        for i in self.angles:
+            x[i] = (x[i] + 180) % 360 - 180
+
+    # Kalman update of the state entries in index with measurement z
+    def correct(self, z, index, noise):
+        H = np.zeros((len(index), 2*self.dims))
+        H[np.arange(len(index)), index] = 1
+        y = z - self.x[index]
+        for k, i in enumerate(index):
+            if i in self.angles:
+                y[k] = (y[k] + 180) % 360 - 180
+
+        S = H.dot(self.P).dot(H.T) + np.diag(np.broadcast_to(noise, (len(index),)))
+        K = self.P.dot(H.T).dot(np.linalg.inv(S))
+        self.x = self.x + K.dot(y)
+        self.P = (np.eye(2*self.dims) - K.dot(H)).dot(self.P)
+        self.wrap(self.x)
+
+    # Measured positions of the coordinates in index (all by default) at time t
+    def updatePosition(self, z, t, index=None, noise=None):
+        index = list(range(self.dims)) if index is None else list(index)
+        z = np.asarray(z, dtype=np.float64).ravel()
+        noise = self.position_noise[index] if noise is None else noise
+
+        if self.t is None:
+            # start at the first measurement with unknown velocity
+            self.x[index] = z
+            self.P = np.eye(2*self.dims) * 1e3
+            self.P[index, index] = np.broadcast_to(noise, (len(index),))
+            self.t = t
+            self.t_position = t
+            return
+
+        if t < self.t:
+            z = z + self.x[[self.dims + i for i in index]] * (self.t - t)
+        else:
+            self.predictTo(t)
+        self.correct(z, index, noise)
+        self.t_position = max(self.t_position, t) if self.t_position is not None else t
+
+    # Measured velocities of the coordinates in index (all by default) at time t
+    def updateVelocity(self, v, t, index=None, noise=None):
+        if self.t is None:
+            return
+        index = list(range(self.dims)) if index is None else list(index)
+        v = np.asarray(v, dtype=np.float64).ravel()
+        noise = self.velocity_noise[index] if noise is None else noise
+
+        self.predictTo(t)
+        self.correct(v, [self.dims + i for i in index], noise)
@@ -0,0 +1,45 @@
+import numpy as np
+from config import CONFIG
+from . import transformations as tf
+
+OUTLIER_K = CONFIG['Fusion']['outlier_k']
+MIN_DISTANCE = CONFIG['Fusion']['min_distance']
+
+class PoseFusion():
+    def __init__(self, marker_map, allow_limit, outlier_k=OUTLIER_K, min_distance=MIN_DISTANCE):
+        # markers of the map are used once allow_use has reached allow_limit
+        self.map = marker_map
+        self.allow_limit = allow_limit
+        self.outlier_k = outlier_k
+        self.min_distance = min_distance
+
+    # Camera position in global coordinates from every usable seen marker
+    # Returns the fused position (1,3) and the number of markers it is based on
+    def fuse(self, seen_id_list, tvecs, rvecs):
+        index, rows = self.map.getRows(seen_id_list)
+        usable = self.map.allow_use[rows] >= self.allow_limit
+        index, rows = index[usable], rows[usable]
+        if len(rows) == 0:
+            return np.zeros((1,3)), 0
+
+        tvecs = np.asarray(tvecs, dtype=np.float64).reshape(-1, 3)[index]
+        rvecs = np.asarray(rvecs, dtype=np.float64).reshape(-1, 3)[index]
+
+        positions = tf.calculatePosBatch(tvecs, rvecs, self.map.tvec_origin[rows], self.map.dRot[rows])
+
+        # pose error grows with the square of the distance to the marker,
+        # markers with a less certain origin count less
+        distance = np.maximum(np.linalg.norm(tvecs, axis=1), self.min_distance)
+        weights = self.map.confidence[rows] / distance**2
+
+        # drop markers far from the median estimate, e.g. with a flipped pose
+        if len(positions) >= 3:
+            residual = np.linalg.norm(positions - np.median(positions, axis=0), axis=1)
+            mad = np.median(residual)
+            if mad > 0:
+                weights = np.where(residual <= self.outlier_k * 1.4826 * mad, weights, 0)
+
+        if not np.any(weights > 0):
+            weights = np.ones(len(positions))
+        position = np.average(positions, axis=0, weights=weights)
+        return position.reshape(1,3), int(np.count_nonzero(weights))
@@ -0,0 +1,217 @@
+import cv2
+import numpy as np
+from collections import defaultdict, deque
+from scipy.optimize import least_squares
+from scipy.sparse import lil_matrix
+from scipy.spatial.transform import Rotation
+from config import CONFIG
+from .marker_map import MarkerMap
+from .marker_class import Markers, ALLOW_LIMIT
+
+MIN_OBSERVATIONS = CONFIG['Map']['min_observations']
+ROTATION_SIGMA = CONFIG['Map']['rotation_sigma']
+TRANSLATION_SIGMA = CONFIG['Map']['translation_sigma']
+OUTLIER_THRESHOLD = CONFIG['Map']['outlier_threshold']
+
+class MapBuilder():
+    """ Builds a marker map offline from marker detections, all solved jointly.
+        Markers are first chained to the origin along the most observed pairs,
+        then marker and camera poses are refined together with least squares on
+        the detected marker poses, so no marker needs ALLOW_LIMIT samples in flight.
+    """
+
+    def __init__(self, origin_id=1, min_observations=MIN_OBSERVATIONS,
+                 rotation_sigma=ROTATION_SIGMA, translation_sigma=TRANSLATION_SIGMA,
+                 outlier_threshold=OUTLIER_THRESHOLD):
+        self.origin_id = origin_id
+        self.min_observations = min_observations
+        self.rotation_sigma = rotation_sigma
+        self.translation_sigma = translation_sigma
+        # relative to the median error of a detection
+        self.outlier_threshold = outlier_threshold
+
+        # frame key -> list of (id, rvec, tvec)
+        self.frames = defaultdict(list)
+
+    # Add the markers seen in one frame, poses are marker -> camera like from Camera.detect
+    def addFrame(self, key, id_list, rvecs, tvecs):
+        rvecs = np.asarray(rvecs, dtype=np.float64).reshape(-1, 3)
+        tvecs = np.asarray(tvecs, dtype=np.float64).reshape(-1, 3)
+        for marker_id, rvec, tvec in zip(id_list, rvecs, tvecs):
+            self.frames[key].append((int(marker_id), rvec, tvec))
+
+    # Add the 'detections' stream of a flight written by lib.recorder.FlightRecorder
+    def addRecording(self, path):
+        from lib.recorder import FlightReader
+
+        data = FlightReader(path).load('detections')
+        for t, frame_seq, marker_id, rvec, tvec in zip(data['t'], data['frame_seq'], data['marker_id'], data['rvec'], data['tvec']):
+            # detections of one frame share the frame number, or the timestamp without one
+            key = (path, int(frame_seq)) if frame_seq >= 0 else (path, float(t))
+            self.frames[key].append((int(marker_id), np.array(rvec), np.array(tvec)))
+
+    # Detect the markers in every step-th frame of a video
+    def addVideo(self, path, camera, step=1):
+        capture = cv2.VideoCapture(path)
+        index = 0
+        while True:
+            ret, frame = capture.read()
+            if not ret:
+                break
+            if index % step == 0:
+                _, id_list, rvecs, tvecs, _, _, _ = camera.detect(frame, draw=False)
+                if len(id_list) > 0:
+                    self.addFrame((path, index), id_list, rvecs, tvecs)
+            index += 1
+        capture.release()
+
+    # Chain markers to the origin along a breadth first spanning tree of co-observations
+    def initialize(self):
+        # relative pose of 'n' in the coordinate system of 'm' for every pair seen together
+        relative = defaultdict(list)
+        for observations in self.frames.values():
+            for m_id, rvec_m, tvec_m in observations:
+                R_m = cv2.Rodrigues(rvec_m)[0]
+                for n_id, rvec_n, tvec_n in observations:
+                    if n_id != m_id:
+                        R_n = cv2.Rodrigues(rvec_n)[0]
+                        relative[(m_id, n_id)].append((R_m.T.dot(R_n), R_m.T.dot(tvec_n - tvec_m)))
+
+        neighbours = defaultdict(list)
+        for (m_id, n_id), samples in relative.items():
+            if len(samples) >= self.min_observations:
+                neighbours[m_id].append(n_id)
+
+        poses = {self.origin_id: (np.eye(3), np.zeros(3))}
+        todo = deque([self.origin_id])
+        while todo:
+            m_id = todo.popleft()
+            dRot_m, tvec_m = poses[m_id]
+            # most observed pairs first
+            for n_id in sorted(neighbours[m_id], key=lambda n: -len(relative[(m_id, n)])):
+                if n_id in poses:
+                    continue
+                samples = relative[(m_id, n_id)]
+                R_rel = Rotation.from_matrix(np.array([R for R, _ in samples])).mean().as_matrix()
+                t_rel = np.median(np.array([t for _, t in samples]), axis=0)
+                poses[n_id] = (dRot_m.dot(R_rel), tvec_m + dRot_m.dot(t_rel))
+                todo.append(n_id)
+
+        return poses
+
+    # Camera pose of every frame with at least two mapped markers, as world -> camera rotation and position
+    def initializeFrames(self, poses):
+        frames = {}
+        for key, observations in self.frames.items():
+            known = [(marker_id, rvec, tvec) for marker_id, rvec, tvec in observations if marker_id in poses]
+            if len(known) < 2:
+                continue
+
+            rotations = []
+            positions = []
+            for marker_id, rvec, tvec in known:
+                dRot, tvec_origin = poses[marker_id]
+                R = cv2.Rodrigues(rvec)[0]
+                rotations.append(R.dot(dRot.T))
+                positions.append(tvec_origin - dRot.dot(R.T.dot(tvec)))
+            frames[key] = (Rotation.from_matrix(np.array(rotations)).mean().as_rotvec(), np.mean(positions, axis=0))
+        return frames
+
+    # Refine all marker and camera poses together
+    def optimize(self, poses, frames):
+        marker_ids = [self.origin_id] + sorted(marker_id for marker_id in poses if marker_id != self.origin_id)
+        marker_rows = {marker_id: i for i, marker_id in enumerate(marker_ids)}
+        frame_keys = list(frames)
+
+        obs_marker = []
+        obs_frame = []
+        obs_rvec = []
+        obs_tvec = []
+        for f, key in enumerate(frame_keys):
+            for marker_id, rvec, tvec in self.frames[key]:
+                if marker_id in marker_rows:
+                    obs_marker.append(marker_rows[marker_id])
+                    obs_frame.append(f)
+                    obs_rvec.append(rvec)
+                    obs_tvec.append(tvec)
+        obs_marker = np.array(obs_marker, dtype=np.int64)
+        obs_frame = np.array(obs_frame, dtype=np.int64)
+        obs_rotation_inv = Rotation.from_rotvec(np.array(obs_rvec)).inv()
+        obs_tvec = np.array(obs_tvec)
+        # translation noise grows with the distance to the marker
+        t_scale = 1 / (self.translation_sigma * np.maximum(np.linalg.norm(obs_tvec, axis=1), 0.1))[:, None]
+
+        # rotations are optimized as small corrections to the initial ones, which
+        # keeps the parametrization far from the singularity of rotation vectors at pi
+        n_markers = len(marker_ids) - 1
+        R0_marker = Rotation.from_matrix(np.array([poses[marker_id][0] for marker_id in marker_ids]))[obs_marker]
+        R0_camera = Rotation.from_rotvec(np.array([frames[key][0] for key in frame_keys]))[obs_frame]
+        x0 = np.concatenate([
+            np.ravel([np.concatenate((np.zeros(3), poses[marker_id][1])) for marker_id in marker_ids[1:]]),
+            np.ravel([np.concatenate((np.zeros(3), frames[key][1])) for key in frame_keys])
+        ])
+
+        # observations rejected as outliers get weight 0
+        weight = np.ones((len(obs_marker), 1))
+
+        def residuals(x):
+            markers = np.vstack((np.zeros((1, 6)), x[:6*n_markers].reshape(-1, 6)))
+            cameras = x[6*n_markers:].reshape(-1, 6)
+
+            R_camera = R0_camera * Rotation.from_rotvec(cameras[obs_frame, :3])
+            R_marker = R0_marker * Rotation.from_rotvec(markers[obs_marker, :3])
+            rotation = (R_camera * R_marker * obs_rotation_inv).as_rotvec() / self.rotation_sigma
+            translation = (R_camera.apply(markers[obs_marker, 3:] - cameras[obs_frame, 3:]) - obs_tvec) * t_scale
+            return (np.hstack((rotation, translation)) * weight).ravel()
+
+        # every observation depends on the pose of its marker and its frame only
+        sparsity = lil_matrix((6*len(obs_marker), len(x0)), dtype=np.int8)
+        for o, (m, f) in enumerate(zip(obs_marker, obs_frame)):
+            if m > 0:
+                sparsity[6*o:6*o+6, 6*(m-1):6*m] = 1
+            sparsity[6*o:6*o+6, 6*(n_markers+f):6*(n_markers+f+1)] = 1
+
+        # a robust loss converges very slowly here, so solve, drop the observations
+        # far off the solution and solve again from there
+        result = least_squares(residuals, x0, jac_sparsity=sparsity, x_scale='jac', method='trf')
+        error = np.sqrt(np.mean(result.fun.reshape(-1, 6)**2, axis=1))
+        outliers = error > self.outlier_threshold * np.median(error)
+        if np.any(outliers):
+            weight[outliers] = 0
+            result = least_squares(residuals, result.x, jac_sparsity=sparsity, x_scale='jac', method='trf')
+        print("Map optimized: cost " + str(round(result.cost, 3)) + " after " + str(result.nfev) + " evaluations, "
+              + str(np.count_nonzero(outliers)) + " of " + str(len(outliers)) + " detections rejected")
+
+        markers = result.x[:6*n_markers].reshape(-1, 6)
+        refined = {self.origin_id: (np.eye(3), np.zeros(3))}
+        for marker_id, params in zip(marker_ids[1:], markers):
+            dRot = poses[marker_id][0].dot(Rotation.from_rotvec(params[:3]).as_matrix())
+            refined[marker_id] = (dRot, params[3:])
+        return refined
+
+    # Build the marker map and the orientation of the origin
+    def build(self):
+        poses = self.initialize()
+        frames = self.initializeFrames(poses)
+        if len(poses) > 1 and frames:
+            poses = self.optimize(poses, frames)
+
+        marker_map = MarkerMap()
+        for marker_id, (dRot, tvec_origin) in poses.items():
+            marker_map.addMarker(marker_id, tvec_origin, Rotation.from_matrix(dRot).as_rotvec(), dRot, ALLOW_LIMIT, 1.)
+
+        orientation = np.zeros((2,3))
+        for observations in self.frames.values():
+            origin = [rvec for marker_id, rvec, _ in observations if marker_id == self.origin_id]
+            if origin:
+                orientation, _ = Markers.getOrientation(origin[0])
+                break
+
+        return marker_map, orientation
+
+    # Build the map and save it in the format Markers.loadMap reads
+    def save(self, path):
+        marker_map, orientation = self.build()
+        marker_map.save(path, orientation=orientation, origin_id=self.origin_id)
+        print("Marker map with " + str(len(marker_map)) + " markers saved")
+        return marker_map
@@ -1,28 +1,35 @@
+import os
 import numpy as np
 from timeit import default_timer as timer
 import time
 import math
-import transformations as tf
+from . import transformations as tf
+from .trajectory import TrajectoryBuffer
+from .fusion import PoseFusion
+from .marker_map import MarkerMap
+from .estimator import OriginEstimator
 import cv2
 import threading
+from config import CONFIG
 
-# limit for averaging
+# samples needed before a marker is used
 ALLOW_LIMIT = 12
 
+MAP_PATH = CONFIG['Map']['path']
+
 class Markers():
-    def __init__(self, MARKER_SIDE, getCoords_event):
-        # intiialise arrays
-        self.ids = []
-        self.tvec_origin = []
-        self.rvec_origin = []
-        self.dRot = []
+    def __init__(self, MARKER_SIDE, getCoords_event, recorder=None, map_path=MAP_PATH, origin_id=1):
+        # stored markers, looked up by id
+        self.map = MarkerMap()
+        # marker at the global origin, a loaded map brings its own
+        self.origin_id = origin_id
         self.angle_origin = np.zeros((1,3))
         self.height_origin = 0
+        self.angle_origin_set = False
 
-        # for filtering values
-        self.allow_use = []
-        self.tvec_max = []
-        self.tvec_min = []
+        # usable markers of the map for getCoords
+        self.fusion = PoseFusion(self.map, ALLOW_LIMIT)
+        self.estimator = OriginEstimator(self.map)
 
         # the first markers orientation
         self.orientation = np.zeros((2,3))
@@ -32,104 +39,69 @@ class Markers():
 
         # for data collection
         self.getCoords_event = getCoords_event
+        self.trajectory = None
+        self.recorder = recorder
+
+        # start from a prebuilt map if there is one, see build_map.py
+        if map_path and os.path.isfile(map_path):
+            self.loadMap(map_path)
 
     # Append marker to the list of stered markers
     def appendMarker(self, seen_id_list, tvec, rvec, angles, tof):
-        for n_id in seen_id_list:
-            n_index = seen_id_list.index(n_id)
-            if n_id == 1 and len(self.ids) == 0:
+        for n_index, n_id in enumerate(seen_id_list):
+            n_row = self.map.getRow(n_id)
+            if n_id == self.origin_id and len(self.map) == 0:
                 # add the first marker as origin
-                self.ids.append(n_id)
-                self.tvec_origin.append(np.array([[0,0,0]]))
-                self.rvec_origin.append(rvec[n_index])
-                self.dRot.append(np.array([[1,0,0],[0,1,0],[0,0,1]]))
-                self.allow_use.append(ALLOW_LIMIT)
-                self.tvec_max.append(0)
-                self.tvec_min.append(10000)
-                self.angle_origin = angles
-                self.height_origin = abs(tof)
-                rvec_Euler = tf.rotationVectorToEulerAngles(rvec[n_index])*180/math.pi
-                # determine orientation
-                orig_type = "?"
-                if abs(rvec_Euler[0][0]) <= 150: # horizontal
-                    self.orientation = np.array([[1, 1, 1],[0, 1, 2]])
-                    orig_type = "Horizontal"
-                elif abs(rvec_Euler[0][0]) > 150: # vertical
-                    self.orientation = np.array([[1, -1, 1],[0, 2, 1]])
-                    orig_type = "Vertical"
-                #print(self.orientation)
+                self.map.addMarker(n_id, np.zeros(3), np.zeros(3), np.eye(3), ALLOW_LIMIT, 1.)
+                self.setAngleOrigin(angles, tof)
+                self.orientation, orig_type = Markers.getOrientation(rvec[n_index])
                 print(orig_type + " origin set")
-            elif n_id not in self.ids and len(self.ids) > 0 and len(seen_id_list) >= 2:
-                # append new marker to lists with dummy values
-                self.ids.append(n_id)
-                self.tvec_origin.append(np.array([[0, 0, 0]]))
-                self.rvec_origin.append(np.array([[0, 0, 0]]))
-                self.dRot.append(np.array([[0,0,0],[0,0,0],[0,0,0]]))
-                self.allow_use.append(0)
-                self.tvec_max.append(0)
-                self.tvec_min.append(10000)
-                for m_id in seen_id_list:
-                    if m_id in self.ids and m_id != n_id and self.allow_use[self.ids.index(m_id)]==ALLOW_LIMIT:
-                        # n is to be added, m is already in list
-                        m_index = seen_id_list.index(m_id)
-                        m_index_list = self.ids.index(m_id)
-                        n_index_list = self.ids.index(n_id)
-                        # calculate needed matrix transformations
-                        t, R, r, a, ma, mi = tf.getTransformations(n_id, tvec[m_index], tvec[n_index], rvec[m_index], rvec[n_index],
-                                                        self.tvec_origin[m_index_list], self.tvec_origin[n_index_list],
-                                                        self.rvec_origin[m_index_list], self.rvec_origin[n_index_list],
-                                                        self.dRot[m_index_list], self.dRot[n_index_list],
-                                                        self.allow_use[n_index_list], ALLOW_LIMIT,
-                                                        self.tvec_max[n_index_list], self.tvec_min[n_index_list])
-                        self.tvec_origin[n_index_list] = t
-                        self.dRot[n_index_list] = R
-                        self.rvec_origin[n_index_list] = r
-                        self.allow_use[n_index_list] = a
-                        self.tvec_max[n_index_list] = ma
-                        self.tvec_min[n_index_list] = mi
-                        break
-            elif n_id in self.ids and self.allow_use[self.ids.index(n_id)]<ALLOW_LIMIT:
-                # marker can be used only after ALLOW_LIMIT has been reached
-                for m_id in seen_id_list:
-                    if m_id in self.ids and m_id != n_id and self.allow_use[self.ids.index(m_id)]==ALLOW_LIMIT:
-                        # n is to be added, m is already in list
-                        m_index = seen_id_list.index(m_id)
-                        m_index_list = self.ids.index(m_id)
-                        n_index_list = self.ids.index(n_id)
-                        # calculate needed matrix transformations
-                        t, R, r, a, ma, mi = tf.getTransformations(n_id, tvec[m_index], tvec[n_index], rvec[m_index], rvec[n_index],
-                                                        self.tvec_origin[m_index_list], self.tvec_origin[n_index_list],
-                                                        self.rvec_origin[m_index_list], self.rvec_origin[n_index_list],
-                                                        self.dRot[m_index_list], self.dRot[n_index_list],
-                                                        self.allow_use[n_index_list], ALLOW_LIMIT,
-                                                        self.tvec_max[n_index_list], self.tvec_min[n_index_list])
-                        self.tvec_origin[n_index_list] = t
-                        self.dRot[n_index_list] = R
-                        self.rvec_origin[n_index_list] = r
-                        self.allow_use[n_index_list] = a
-                        self.tvec_max[n_index_list] = ma
-                        self.tvec_min[n_index_list] = mi
-                        break
+            elif n_id == self.origin_id and not self.angle_origin_set:
+                # origin of a loaded map seen for the first time
+                self.setAngleOrigin(angles, tof)
+            elif n_row is None and len(self.map) > 0 and len(seen_id_list) >= 2:
+                # append new marker with dummy values
+                n_row = self.map.addMarker(n_id)
+                self.updateMarker(n_id, n_index, n_row, seen_id_list, tvec, rvec)
+            elif n_row is not None and n_id != self.origin_id:
+                # marker can be used only after ALLOW_LIMIT has been reached, but keeps improving afterwards
+                self.updateMarker(n_id, n_index, n_row, seen_id_list, tvec, rvec)
 
-    # Calculate camera pose from seen markers
-    def getCoords(self, seen_id_list, tvecs, rvecs, angles):
-        length = len(seen_id_list)
-        len_diff = 0
-        dtv = np.zeros((1,3))
-        drv = np.zeros((1,3))
+    # Determine the orientation of the origin from its rotation vector
+    @staticmethod
+    def getOrientation(rvec):
+        rvec_Euler = tf.rotationVectorToEulerAngles(np.reshape(rvec, (1,3)))*180/math.pi
+        if abs(rvec_Euler[0][0]) <= 150: # horizontal
+            return np.array([[1, 1, 1],[0, 1, 2]]), "Horizontal"
+        # vertical
+        return np.array([[1, -1, 1],[0, 2, 1]]), "Vertical"
+
+    # Rotation and height are measured relative to the first sight of the origin
+    def setAngleOrigin(self, angles, tof):
+        self.angle_origin = angles
+        self.height_origin = abs(tof)
+        self.angle_origin_set = True
+
+    # Add a sample to the transformation of marker 'n' from a usable marker 'm' seen in the same frame
+    def updateMarker(self, n_id, n_index, n_row, seen_id_list, tvec, rvec):
+        for m_index, m_id in enumerate(seen_id_list):
+            m_row = self.map.getRow(m_id)
+            if m_row is not None and m_id != n_id and self.map.allow_use[m_row]>=ALLOW_LIMIT:
+                # calculate needed matrix transformations
+                t, R = tf.getMarkerSample(tvec[m_index], tvec[n_index], rvec[m_index], rvec[n_index],
+                                          self.map.tvec_origin[m_row], self.map.dRot[m_row])
+                usable = self.map.allow_use[n_row]>=ALLOW_LIMIT
+                if self.estimator.update(n_row, t, R) and not usable and self.map.allow_use[n_row]>=ALLOW_LIMIT:
+                    print("Marker "+str(n_id)+" transformations calculated")
+                break
 
+    # Calculate camera pose from seen markers
+    # With the Camera that detected them, the position comes from one solve over all their corners
+    def getCoords(self, seen_id_list, tvecs, rvecs, angles, camera=None):
         # calculating translation
-        for i in range(length):
-            if seen_id_list[i] in self.ids:
-                ind = self.ids.index(seen_id_list[i])
-                if self.allow_use[ind] == ALLOW_LIMIT:
-                    dtv = dtv + tf.calculatePos(tvecs[i], rvecs[i], self.tvec_origin[ind], self.dRot[ind])
-                else:
-                    len_diff = len_diff + 1
-
-        length = length - len_diff
-        if length>0:
-            dtv=dtv/length
+        dtv = camera.locate(self.map, ALLOW_LIMIT) if camera is not None else None
+        if dtv is None:
+            dtv, _ = self.fusion.fuse(seen_id_list, tvecs, rvecs)
 
         # calculating rotation
         drv = angles - self.angle_origin
@@ -138,45 +110,48 @@ class Markers():
     
     # Check if ID already stored
     def ContainsIDs(self, seen_id_list):
-        temp = False
-        for ID in seen_id_list:
-            if ID in self.ids:
-                temp = True
-        
-        return temp
+        return any(ID in self.map for ID in seen_id_list)
 
     # Reset the coordinate system
     def nullCoords(self):
-        self.ids = []
-        self.tvec_origin = []
-        self.rvec_origin = []
-        self.dRot = []
-        self.allow_use = []
-        self.tvec_max = []
-        self.tvec_min = []
+        self.map.reset()
         self.orientation = np.zeros((2,3))
         self.angle_origin = np.zeros((1,3))
         self.height_origin = 0
+        self.angle_origin_set = False
+
+    # Save the learned marker map to reuse it in later flights
+    def saveMap(self, path):
+        self.map.save(path, orientation=self.orientation, origin_id=self.origin_id)
+        print("Marker map saved")
+
+    # Load a saved marker map, rotation and height are taken when the origin is seen
+    def loadMap(self, path):
+        extra = self.map.load(path)
+        self.orientation = extra.get('orientation', np.zeros((2,3)))
+        # maps saved before the origin id was stored are rooted at marker 1
+        self.origin_id = int(extra.get('origin_id', 1))
+        self.angle_origin = np.zeros((1,3))
+        self.height_origin = 0
+        self.angle_origin_set = False
+        print("Marker map loaded with "+str(len(self.map))+" markers")
 
     # Calculate and store movement points during navigation
-    def getMov(self, seen_id_list, tvecs, rvecs, angles):
+    def getMov(self, seen_id_list, tvecs, rvecs, angles, camera=None):
         if self.getCoords_event.is_set() and not self.OpenedFile:
-            dtv, drv = self.getCoords(seen_id_list, tvecs, rvecs, angles)
+            dtv, drv = self.getCoords(seen_id_list, tvecs, rvecs, angles, camera)
             self.start=timer()
-            self.t=[0]
-            self.tvec_all=dtv
-            self.rvec_all=drv
+            self.trajectory = TrajectoryBuffer(recorder=self.recorder)
+            self.trajectory.append(0, dtv, drv)
             self.OpenedFile=True
             print("Collecting data")
         elif self.getCoords_event.is_set() and self.OpenedFile:
-            dtv, drv = self.getCoords(seen_id_list, tvecs, rvecs, angles)
-            self.t=np.append(self.t,[timer()-self.start],axis=0)
-            self.tvec_all=np.append(self.tvec_all,dtv,axis=0)
-            self.rvec_all=np.append(self.rvec_all,drv,axis=0)
+            dtv, drv = self.getCoords(seen_id_list, tvecs, rvecs, angles, camera)
+            self.trajectory.append(timer()-self.start, dtv, drv)
         elif not self.getCoords_event.is_set() and self.OpenedFile:
             timestr = time.strftime("%Y%m%d_%H%M%S")
-            np.savez("results/movement_"+timestr, t=self.t, tvecs=self.tvec_all, rvecs=self.rvec_all,
-                     t_origin=np.asarray(self.tvec_origin), r_origin=np.asarray(self.rvec_origin),
+            self.trajectory.save("results/movement_"+timestr,
+                     t_origin=self.map.getTvecOrigins()[:, None], r_origin=self.map.getRvecOrigins()[:, None],
                      orientation=self.orientation, height_origin=self.height_origin)
             self.OpenedFile=False
             print("Dataset saved")
\ No newline at end of file
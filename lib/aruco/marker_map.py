@@ -0,0 +1,100 @@
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+# per marker arrays, all stored with the map
+ARRAYS = ('ids', 'tvec_origin', 'rvec_origin', 'dRot', 'allow_use', 'tvec_m2', 'quat_acc', 'confidence')
+
+class MarkerMap():
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.reset()
+
+    def reset(self):
+        # marker id -> row of the arrays below, rows are kept in insertion order
+        self.rows = {}
+        self.ids = np.zeros(self.capacity, dtype=np.int64)
+        self.tvec_origin = np.zeros((self.capacity, 3))
+        self.rvec_origin = np.zeros((self.capacity, 3))
+        self.dRot = np.zeros((self.capacity, 3, 3))
+        self.allow_use = np.zeros(self.capacity, dtype=np.int64)
+
+        # running estimates, see estimator.py
+        self.tvec_m2 = np.zeros((self.capacity, 3, 3))
+        self.quat_acc = np.zeros((self.capacity, 4, 4))
+        self.confidence = np.zeros(self.capacity)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, marker_id):
+        return marker_id in self.rows
+
+    # Row of a marker, None if it is not stored
+    def getRow(self, marker_id):
+        return self.rows.get(marker_id)
+
+    # Positions in ids and rows of the stored markers among ids
+    def getRows(self, ids):
+        found = [(i, self.rows[marker_id]) for i, marker_id in enumerate(ids) if marker_id in self.rows]
+        if not found:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        index, rows = np.array(found, dtype=np.int64).T
+        return index, rows
+
+    def getIds(self):
+        return self.ids[:len(self)]
+
+    def getTvecOrigins(self):
+        return self.tvec_origin[:len(self)]
+
+    def getRvecOrigins(self):
+        return self.rvec_origin[:len(self)]
+
+    # Double the capacity of all arrays
+    def grow(self):
+        n = len(self)
+        for name in ARRAYS:
+            old = getattr(self, name)
+            new = np.zeros((2*len(old),) + old.shape[1:], dtype=old.dtype)
+            new[:n] = old[:n]
+            setattr(self, name, new)
+
+    # Store a new marker and return its row, a known pose counts as allow_use samples
+    def addMarker(self, marker_id, tvec_origin=None, rvec_origin=None, dRot=None, allow_use=0, confidence=0.):
+        row = len(self)
+        if row == len(self.ids):
+            self.grow()
+
+        self.rows[marker_id] = row
+        self.ids[row] = marker_id
+        self.tvec_origin[row] = 0 if tvec_origin is None else np.ravel(tvec_origin)
+        self.rvec_origin[row] = 0 if rvec_origin is None else np.ravel(rvec_origin)
+        self.dRot[row] = 0 if dRot is None else dRot
+        self.allow_use[row] = allow_use
+        self.tvec_m2[row] = 0
+        self.quat_acc[row] = 0
+        if dRot is not None and allow_use > 0:
+            q = Rotation.from_matrix(dRot).as_quat()
+            self.quat_acc[row] = allow_use * np.outer(q, q)
+        self.confidence[row] = confidence
+        return row
+
+    # Save the map as .npz, extra arrays are stored as well
+    def save(self, path, **extra):
+        n = len(self)
+        np.savez(path, **{name: getattr(self, name)[:n] for name in ARRAYS}, **extra)
+
+    # Replace the map with a saved one, returns the extra arrays stored with it
+    def load(self, path):
+        with np.load(path) as data:
+            self.capacity = max(self.capacity, len(data['ids']))
+            self.reset()
+            for i, marker_id in enumerate(data['ids'].tolist()):
+                self.addMarker(marker_id, data['tvec_origin'][i], data['rvec_origin'][i], data['dRot'][i], data['allow_use'][i])
+            # older map files have no running estimates
+            n = len(self)
+            for name in ('tvec_m2', 'quat_acc', 'confidence'):
+                if name in data.files:
+                    getattr(self, name)[:n] = data[name]
+
+            return {key: data[key] for key in data.files if key not in ARRAYS}
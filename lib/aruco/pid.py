@@ -1,19 +1,23 @@
 class PID(object):
-    def __init__(self, kp, ki, kd):
+    def __init__(self, kp, ki, kd, period=None):
         self.kp = kp
         self.ki = ki
         self.kd = kd
+        # seconds per step the gains were tuned for, None counts every call as one step
+        self.period = period
         self.error_int = 0
         self.error_prev = None
 
-    def control(self, error):
-        self.error_int += error
+    def control(self, error, dt=None):
+        # fraction of a tuned step since the last call, keeps I and D independent of the call rate
+        steps = 1. if dt is None or self.period is None else dt / self.period
+        self.error_int += error * steps
         if self.error_prev is None:
             self.error_prev = error
-        error_deriv = error - self.error_prev
+        error_deriv = (error - self.error_prev) / steps if steps > 0 else 0.
         self.error_prev = error
         return self.kp * error + self.ki * self.error_int + self.kd * error_deriv
 
     def reset(self):
         self.error_prev = None
-        self.error_int = 0
\ No newline at end of file
+        self.error_int = 0
@@ -0,0 +1,109 @@
+import cv2
+import numpy as np
+from config import CONFIG
+
+MARKER_LENGTH = CONFIG['Aruco']['marker_length']
+POSE_RANSAC = CONFIG['Pose']['ransac']
+REPROJECTION_ERROR = CONFIG['Pose']['reprojection_error']
+
+class PoseEstimator():
+    def __init__(self, marker_length=MARKER_LENGTH, ransac=POSE_RANSAC, reprojection_error=REPROJECTION_ERROR):
+        # corners in the order the detector returns them, as required by SOLVEPNP_IPPE_SQUARE
+        half = marker_length / 2
+        self.object_points = np.array([[-half, half, 0], [half, half, 0],
+                                       [half, -half, 0], [-half, -half, 0]], dtype=np.float64)
+        self.ransac = ransac
+        self.reprojection_error = reprojection_error
+
+        # marker id -> (rvec, tvec) of the previous frame
+        self.previous = {}
+        # global -> camera pose of the previous frame from the joint solve
+        self.camera_rvec = None
+        self.camera_tvec = None
+
+    def reset(self):
+        self.previous = {}
+        self.camera_rvec = None
+        self.camera_tvec = None
+
+    # Pose of every marker in the camera, shaped like estimatePoseSingleMarkers returns it
+    def estimateMarkers(self, id_list, corners, mtx, dist):
+        rvecs = np.zeros((len(id_list), 1, 3))
+        tvecs = np.zeros((len(id_list), 1, 3))
+        current = {}
+
+        for i, (marker_id, corner) in enumerate(zip(id_list, corners)):
+            image_points = np.asarray(corner, dtype=np.float64).reshape(4, 2)
+            # IPPE returns both poses a square can have, the flip ambiguity is
+            # resolved with the previous frame and otherwise by reprojection error
+            _, solutions_r, solutions_t, _ = cv2.solvePnPGeneric(self.object_points, image_points, mtx, dist,
+                                                                      flags=cv2.SOLVEPNP_IPPE_SQUARE)
+            best = 0
+            if marker_id in self.previous and len(solutions_r) > 1:
+                previous_R = cv2.Rodrigues(self.previous[marker_id][0])[0]
+                angles = [np.linalg.norm(cv2.Rodrigues(cv2.Rodrigues(r)[0].dot(previous_R.T))[0]) for r in solutions_r]
+                best = int(np.argmin(angles))
+
+            rvecs[i, 0] = solutions_r[best].ravel()
+            tvecs[i, 0] = solutions_t[best].ravel()
+            current[marker_id] = (rvecs[i, 0], tvecs[i, 0])
+
+        self.previous = current
+        return rvecs, tvecs
+
+    # Global corner positions of the usable markers among id_list
+    def getWorldPoints(self, id_list, corners, marker_map, allow_limit):
+        index, rows = marker_map.getRows(id_list)
+        usable = marker_map.allow_use[rows] >= allow_limit
+        index, rows = index[usable], rows[usable]
+        if len(rows) == 0:
+            return None, None
+
+        # p_global = tvec_origin + dRot p_marker for all four corners of all markers
+        world = marker_map.tvec_origin[rows][:, None, :] + np.einsum('nij,kj->nki', marker_map.dRot[rows], self.object_points)
+        image = np.concatenate([np.asarray(corners[i], dtype=np.float64).reshape(4, 2) for i in index])
+        return world.reshape(-1, 3), image
+
+    # Camera position in global coordinates from one solve over all mapped markers
+    # Returns the position (1,3) or None if no usable marker is seen
+    def estimateCamera(self, id_list, corners, marker_map, allow_limit, mtx, dist):
+        world, image = self.getWorldPoints(id_list, corners, marker_map, allow_limit)
+        if world is None:
+            self.camera_rvec = None
+            self.camera_tvec = None
+            return None
+
+        ok = False
+        if self.camera_rvec is not None:
+            # refine last frame's pose, the drone moves little between frames
+            ok, rvec, tvec = cv2.solvePnP(world, image, mtx, dist, self.camera_rvec.copy(), self.camera_tvec.copy(),
+                                          useExtrinsicGuess=True, flags=cv2.SOLVEPNP_ITERATIVE)
+            ok = ok and self.getReprojectionError(world, image, rvec, tvec, mtx, dist) < self.reprojection_error
+
+        if not ok and len(world) == 4:
+            ok, rvec, tvec = cv2.solvePnP(world, image, mtx, dist, flags=cv2.SOLVEPNP_IPPE)
+        elif not ok and self.ransac:
+            ok, rvec, tvec, inliers = cv2.solvePnPRansac(world, image, mtx, dist, reprojectionError=self.reprojection_error,
+                                                         flags=cv2.SOLVEPNP_SQPNP)
+            if ok and inliers is not None and len(inliers) >= 4:
+                # the RANSAC pose comes from a minimal sample, refine it on all inliers
+                inliers = inliers.ravel()
+                rvec, tvec = cv2.solvePnPRefineLM(world[inliers], image[inliers], mtx, dist, rvec, tvec)
+        elif not ok:
+            ok, rvec, tvec = cv2.solvePnP(world, image, mtx, dist, flags=cv2.SOLVEPNP_SQPNP)
+
+        if not ok:
+            self.camera_rvec = None
+            self.camera_tvec = None
+            return None
+
+        self.camera_rvec = rvec
+        self.camera_tvec = tvec
+        # camera position is -R.T.dot(tvec) in global coordinates
+        R = cv2.Rodrigues(rvec)[0]
+        return -R.T.dot(tvec).reshape(1, 3)
+
+    # Mean reprojection error in pixels
+    def getReprojectionError(self, world, image, rvec, tvec, mtx, dist):
+        projected, _ = cv2.projectPoints(world, rvec, tvec, mtx, dist)
+        return np.mean(np.linalg.norm(projected.reshape(-1, 2) - image, axis=1))
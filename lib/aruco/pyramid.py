@@ -0,0 +1,69 @@
+import cv2
+import numpy as np
+from config import CONFIG
+
+PYRAMID_ENABLED = CONFIG['Pyramid']['enabled']
+PYRAMID_SCALES = CONFIG['Pyramid']['scales']
+MIN_MARKER_SIDE = CONFIG['Pyramid']['min_marker_side']
+FULL_SCAN_INTERVAL = CONFIG['Pyramid']['full_scan_interval']
+
+class PyramidDetector():
+    def __init__(self, enabled=PYRAMID_ENABLED, scales=PYRAMID_SCALES, min_side=MIN_MARKER_SIDE,
+                 full_scan_interval=FULL_SCAN_INTERVAL):
+        self.enabled = enabled
+        # from the finest to the coarsest level
+        self.scales = sorted(scales, reverse=True)
+        self.min_side = min_side
+        self.scale = self.scales[0]
+        # every full_scan_interval frames the full image is searched for far away markers
+        self.full_scan_interval = full_scan_interval
+        self.since_full_scan = 0
+
+        self.criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+
+    # Detect on a downscaled copy of gray and refine the corners at full resolution
+    def detect(self, detector, gray):
+        scale = self.scale if self.enabled else 1.0
+        if self.since_full_scan >= self.full_scan_interval:
+            scale = self.scales[0]
+        self.since_full_scan = 0 if scale == self.scales[0] else self.since_full_scan + 1
+
+        if scale == 1.0:
+            corners, ids, _ = detector.detectMarkers(gray)
+        else:
+            small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            corners, ids, _ = detector.detectMarkers(small)
+            if ids is not None:
+                corners = self.refine(gray, corners, scale)
+
+        if self.enabled:
+            self.adapt(corners)
+
+        return corners, ids
+
+    # Scale corners found on a pyramid level up to full resolution and refine them there
+    def refine(self, gray, corners, scale):
+        points = np.concatenate(corners).reshape(-1,1,2) / scale
+        points = points.astype(np.float32)
+
+        # one pixel on the coarse level covers 1/scale pixels on the full image
+        win = int(np.ceil(1 / scale)) + 1
+        cv2.cornerSubPix(gray, points, (win, win), (-1, -1), self.criteria)
+
+        return tuple(points.reshape(-1,1,4,2))
+
+    # Pick the coarsest level on which the smallest visible marker is still large enough
+    def adapt(self, corners):
+        if len(corners) == 0:
+            # nothing seen, search for far away markers on the full image again
+            self.scale = self.scales[0]
+            return
+
+        points = np.concatenate(corners).reshape(-1,4,2)
+        sides = np.linalg.norm(points - np.roll(points, 1, axis=1), axis=2)
+        side = sides.min()
+
+        self.scale = self.scales[0]
+        for scale in self.scales:
+            if side * scale >= self.min_side:
+                self.scale = scale
@@ -0,0 +1,63 @@
+import numpy as np
+from config import CONFIG
+
+TRACK_MARGIN = CONFIG['Tracking']['margin']
+TRACK_VELOCITY_GAIN = CONFIG['Tracking']['velocity_gain']
+MAX_MISSES = CONFIG['Tracking']['max_misses']
+FULL_SCAN_INTERVAL = CONFIG['Tracking']['full_scan_interval']
+
+class MarkerTracker():
+    def __init__(self, margin=TRACK_MARGIN, velocity_gain=TRACK_VELOCITY_GAIN,
+                 max_misses=MAX_MISSES, full_scan_interval=FULL_SCAN_INTERVAL):
+        self.margin = margin
+        self.velocity_gain = velocity_gain
+        self.max_misses = max_misses
+        self.full_scan_interval = full_scan_interval
+
+        self.reset()
+
+    def reset(self):
+        self.corners = None
+        # marker centre displacement in pixels per frame
+        self.velocity = np.zeros(2)
+        self.misses = 0
+        self.since_full_scan = 0
+
+    # Search window (x, y, w, h) for the next frame, None when a full-frame scan is due
+    def getWindow(self, w, h):
+        if self.corners is None or self.misses >= self.max_misses or self.since_full_scan >= self.full_scan_interval:
+            return None
+
+        # predict where the marker will be and grow the box with its size and speed
+        predicted = self.corners + self.velocity
+        x0, y0 = predicted.min(axis=0)
+        x1, y1 = predicted.max(axis=0)
+        pad = self.margin * max(x1 - x0, y1 - y0) + self.velocity_gain * np.linalg.norm(self.velocity)
+
+        x0 = int(max(0, x0 - pad))
+        y0 = int(max(0, y0 - pad))
+        x1 = int(min(w, x1 + pad))
+        y1 = int(min(h, y1 + pad))
+        if x1 <= x0 or y1 <= y0:
+            return None
+
+        return x0, y0, x1 - x0, y1 - y0
+
+    # Update with the target's corners (None if not seen) and whether the frame was fully scanned
+    def update(self, corners, full_scan):
+        self.since_full_scan = 0 if full_scan else self.since_full_scan + 1
+
+        if corners is None:
+            if full_scan:
+                # lost on a full scan, nothing to track any more
+                self.reset()
+            else:
+                self.misses += 1
+            return
+
+        corners = np.asarray(corners, dtype=np.float64).reshape(4, 2)
+        if self.corners is not None:
+            step = (corners.mean(axis=0) - self.corners.mean(axis=0)) / (self.misses + 1)
+            self.velocity = 0.5 * self.velocity + 0.5 * step
+        self.corners = corners
+        self.misses = 0
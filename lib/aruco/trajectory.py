@@ -0,0 +1,58 @@
+import time
+import numpy as np
+
+TRAJECTORY_COLUMNS = {
+    't': np.float64,
+    'rel_t': np.float64,
+    'tvec': (np.float64, (3,)),
+    'rvec': (np.float64, (3,))
+}
+
+class TrajectoryBuffer():
+    def __init__(self, capacity=1024, recorder=None):
+        self.t = np.empty(capacity)
+        self.tvec = np.empty((capacity, 3))
+        self.rvec = np.empty((capacity, 3))
+        self.n = 0
+
+        # optional lib.recorder.FlightRecorder that streams every point to disk
+        self.recorder = recorder
+        if recorder is not None and 'trajectory' not in recorder.streams:
+            recorder.addStream('trajectory', TRAJECTORY_COLUMNS)
+
+    def __len__(self):
+        return self.n
+
+    # Double the capacity, so appending costs amortized O(1) per point
+    def grow(self):
+        capacity = 2 * len(self.t)
+        for name in ('t', 'tvec', 'rvec'):
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:])
+            new[:self.n] = old[:self.n]
+            setattr(self, name, new)
+
+    def append(self, t, tvec, rvec):
+        if self.n == len(self.t):
+            self.grow()
+
+        self.t[self.n] = t
+        self.tvec[self.n] = np.ravel(tvec)
+        self.rvec[self.n] = np.ravel(rvec)
+        self.n += 1
+
+        if self.recorder is not None:
+            self.recorder.record('trajectory', t=time.time(), rel_t=t, tvec=self.tvec[self.n-1], rvec=self.rvec[self.n-1])
+
+    def getT(self):
+        return self.t[:self.n]
+
+    def getTvecs(self):
+        return self.tvec[:self.n]
+
+    def getRvecs(self):
+        return self.rvec[:self.n]
+
+    # Save in the same layout as the movement files, extra arrays are stored as well
+    def save(self, path, **extra):
+        np.savez(path, t=self.getT(), tvecs=self.getTvecs(), rvecs=self.getRvecs(), **extra)
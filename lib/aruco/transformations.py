@@ -3,62 +3,20 @@ import math
 import cv2
 from scipy.spatial.transform import Rotation
 
-# Calculate transformation matrices and average them
-def getTransformations(n_id, tvec_m, tvec_n, rvec_m, rvec_n, tvec_orig_m, tvec_orig_n, rvec_orig_m,
-                       rvec_orig_n, dRot_m, dRot_n, allow_use, ALLOW_LIMIT, tvec_max_n, tvec_min_n):
-    if allow_use < ALLOW_LIMIT:
-        tvec_m = np.transpose(tvec_m) # tvec of 'm' marker
-        tvec_n = np.transpose(tvec_n) # tvec of 'n' marker
-        tvec_orig_m = np.transpose(tvec_orig_m) # origin of 'm' in global coordinates
-        tvec_orig_n = np.transpose(tvec_orig_n) # origin to be of 'n' in global coordinates
-        dtvec = tvec_m - tvec_n # vector from 'm' to 'n' marker in the camera's coordinate system
-        # get the markers' rotation matrices respectively
-        R_m = cv2.Rodrigues(rvec_m)[0]
-        R_n = cv2.Rodrigues(rvec_n)[0]
+# One sample of the transformation of marker 'n' to global, from marker 'm' seen in the same frame
+def getMarkerSample(tvec_m, tvec_n, rvec_m, rvec_n, tvec_orig_m, dRot_m):
+    tvec_m = np.reshape(tvec_m, (3,1)) # tvec of 'm' marker
+    tvec_n = np.reshape(tvec_n, (3,1)) # tvec of 'n' marker
+    tvec_orig_m = np.reshape(tvec_orig_m, (3,1)) # origin of 'm' in global coordinates
+    dtvec = tvec_m - tvec_n # vector from 'm' to 'n' marker in the camera's coordinate system
+    # get the markers' rotation matrices respectively
+    R_m = cv2.Rodrigues(np.reshape(rvec_m, (3,1)))[0]
+    R_n = cv2.Rodrigues(np.reshape(rvec_n, (3,1)))[0]
 
-        # for filtering out min and max values
-        tvec_temp = tvec_orig_m + dRot_m.dot(-R_m.T.dot(dtvec))
-        if np.linalg.norm(tvec_temp) > np.linalg.norm(tvec_max_n):
-            tvec_max_n = tvec_temp
-        if np.linalg.norm(tvec_temp) < np.linalg.norm(tvec_min_n):
-            tvec_min_n = tvec_temp
+    tvec_orig_n = tvec_orig_m + dRot_m.dot(-R_m.T.dot(dtvec)) # origin of 'n' in global
+    dRot_n = dRot_m.dot(R_m.T.dot(R_n)) # rotation matrix from 'n' to global
 
-        tvec_orig_n = tvec_orig_n + tvec_temp
-
-        dRot_n = dRot_n + dRot_m.dot(R_m.T.dot(R_n))
-
-        # rotations
-        # rvec_m = np.transpose(rvec_m)
-        # rvec_n = np.transpose(rvec_n)
-        # rvec_orig_m = np.transpose(rvec_orig_m)
-        # rvec_orig_n = np.transpose(rvec_orig_n)
-        # drvec = rvec_m - rvec_n
-        # rvec_orig_n = rvec_orig_n + rvec_orig_m - dRot_m.dot(-R_m.T.dot(drvec))
-
-        allow_use += 1
-    
-    if allow_use == ALLOW_LIMIT:
-        #tvec_mm = tvec_orig_m + dRot_m.dot(-R_m.T.dot(tvec_m)) # camera pose in 'm' marker's coordinate system
-        #tvec_nn = -R_n.T.dot(tvec_n) # camera pose in 'n' marker's coordinate system
-        tvec_orig_n = tvec_orig_n - tvec_max_n - tvec_min_n
-        tvec_orig_n = tvec_orig_n/(ALLOW_LIMIT-2) # the origin of 'n' in global
-        dRot_n = dRot_n/ALLOW_LIMIT # rotation matrix from 'n' to global
-        #tvec_nm = tvec_orig_n + dRot_n.dot(tvec_nn) # camera pose from 'n' to global
-
-        rvec_orig_n = rotationMatrixToRotationVector(-dRot_n.T) # the orientation of 'n'
-        # print("rvec_orig_n:")
-        # print(rotationVectorToEulerAngles(rvec_orig_n)*180/math.pi)
-        # print("tvec_mm:")
-        # print(tvec_mm)
-        # print("tvec_nm:")
-        # print(tvec_nm)
-        print("Marker "+str(n_id)+" transformations calculated")
-    
-    # transose for row vector
-    tvec_orig_n = np.transpose(tvec_orig_n)
-    #rvec_orig_n = np.transpose(rvec_orig_n)
-
-    return tvec_orig_n, dRot_n, rvec_orig_n, allow_use, tvec_max_n, tvec_min_n
+    return tvec_orig_n.ravel(), dRot_n
 
 # Calculate position data from stored values and current values
 def calculatePos(tvec, rvec, tvec_orig, dRot):
@@ -70,6 +28,32 @@ def calculatePos(tvec, rvec, tvec_orig, dRot):
     tvec = np.transpose(tvec)
     return tvec
 
+# Convert rotation vectors of shape (n,3) to rotation matrices of shape (n,3,3) at once
+def rodriguesBatch(rvecs):
+    rvecs = np.asarray(rvecs, dtype=np.float64).reshape(-1, 3)
+    theta = np.linalg.norm(rvecs, axis=1)
+    # the axis is arbitrary for (almost) zero rotations, sin and 1-cos vanish there anyway
+    axis = rvecs / np.where(theta > 1e-12, theta, 1.)[:, None]
+
+    K = np.zeros((len(rvecs), 3, 3))
+    K[:, 0, 1] = -axis[:, 2]
+    K[:, 0, 2] = axis[:, 1]
+    K[:, 1, 0] = axis[:, 2]
+    K[:, 1, 2] = -axis[:, 0]
+    K[:, 2, 0] = -axis[:, 1]
+    K[:, 2, 1] = axis[:, 0]
+
+    sin = np.sin(theta)[:, None, None]
+    cos = np.cos(theta)[:, None, None]
+    return np.eye(3) + sin*K + (1-cos)*np.matmul(K, K)
+
+# Vectorized calculatePos, one row per marker: tvecs, rvecs and tvec_orig (n,3), dRot (n,3,3)
+def calculatePosBatch(tvecs, rvecs, tvec_orig, dRot):
+    tvecs = np.asarray(tvecs, dtype=np.float64).reshape(-1, 3)
+    R = rodriguesBatch(rvecs)
+    # -R.T.dot(tvec) in every marker's coordinate system, then moved to global
+    return tvec_orig - np.einsum('nij,nkj,nk->ni', dRot, R, tvecs)
+
 # Get position in marker's coordinate system
 def TranslationInMarker(rvec, tvec):
     tvec = np.transpose(tvec)
@@ -93,9 +77,9 @@ def rotationVectorToEulerAngles(rvec):
 
 # Calculates rotation matrix to rotation vector
 def rotationMatrixToRotationVector(dR):
-    r = Rotation.from_dcm(dR)
+    r = Rotation.from_matrix(dR)
     return r.as_rotvec()
 
 # r = Rotation.from_rotvec(np.array([0.4472136,-0.4472136,-0.77459667]))
-# r = Rotation.from_dcm(np.array([[0,0.5,-math.sqrt(3)/2],[-1,0,0],[0,math.sqrt(3)/2,0.5]]))
+# r = Rotation.from_matrix(np.array([[0,0.5,-math.sqrt(3)/2],[-1,0,0],[0,math.sqrt(3)/2,0.5]]))
 # print(r.as_euler('zyz')*180/np.pi)
\ No newline at end of file
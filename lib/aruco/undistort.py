@@ -0,0 +1,77 @@
+import os
+import cv2
+import numpy as np
+from timeit import default_timer as timer
+from config import CONFIG
+
+CALIB_CHECK_INTERVAL = CONFIG['Camera']['calib_check_interval']
+
+class Undistorter():
+    def __init__(self, cam_data):
+        self.cam_data = cam_data
+
+        self.mtx = None
+        self.dist = None
+        self.zero_dist = np.zeros((1,5))
+        # camera matrix of the last undistorted and cropped frame
+        self.new_mtx = None
+
+        # remap tables keyed by frame resolution
+        self.maps = {}
+
+        self.calib_mtime = None
+        self.t_check = 0
+
+    # Load the calibration file, dropping cached maps when it has changed on disk
+    def load(self):
+        now = timer()
+        if self.mtx is not None and now - self.t_check < CALIB_CHECK_INTERVAL:
+            return
+        self.t_check = now
+
+        mtime = os.stat(self.cam_data).st_mtime
+        if mtime == self.calib_mtime:
+            return
+
+        with np.load(self.cam_data) as X:
+            self.setCalibration(X['mtx'], X['dist'])
+        self.calib_mtime = mtime
+
+    # Use a new calibration and invalidate all cached maps
+    def setCalibration(self, mtx, dist):
+        self.mtx = mtx
+        self.dist = dist
+        self.maps = {}
+
+    # Compute the undistortion maps once per resolution
+    def getMaps(self, w, h):
+        if (w, h) not in self.maps:
+            newcameramtx, roi = cv2.getOptimalNewCameraMatrix(self.mtx, self.dist, (w,h), 1, (w,h))
+            # fixed-point maps make remap noticeably cheaper than float maps
+            map1, map2 = cv2.initUndistortRectifyMap(self.mtx, self.dist, None, newcameramtx, (w,h), cv2.CV_16SC2)
+            self.maps[(w, h)] = (map1, map2, newcameramtx, roi)
+        return self.maps[(w, h)]
+
+    # Undistort a frame and crop it to the valid region
+    def undistort(self, frame):
+        self.load()
+
+        h, w = frame.shape[:2]
+        map1, map2, newcameramtx, roi = self.getMaps(w, h)
+
+        frame = cv2.remap(frame, map1, map2, cv2.INTER_LINEAR)
+
+        # cropping moves the principal point with the corner of the valid region
+        x,y,w,h = roi
+        self.new_mtx = newcameramtx.copy()
+        self.new_mtx[0, 2] -= x
+        self.new_mtx[1, 2] -= y
+        return frame[y:y+h, x:x+w]
+
+    # Undistort only the detected marker corners, keeping them in pixel coordinates
+    def undistortCorners(self, corners):
+        self.load()
+
+        points = np.concatenate(corners).reshape(-1,1,2)
+        points = cv2.undistortPoints(points, self.mtx, self.dist, P=self.mtx)
+        return list(points.reshape(-1,1,4,2))
@@ -1,2 +1,5 @@
-from .tello import Tello, TelloException, BackgroundFrameRead
-from .swarm import TelloSwarm
\ No newline at end of file
+from .tello import Tello, TelloException, BackgroundFrameRead, FrameBuffer
+from .state import TelloState, StateDecoder
+from .telemetry import TelemetryHistory
+from .swarm import TelloSwarm
+from .async_tello import AsyncTello, AsyncTelloSwarm
\ No newline at end of file
@@ -0,0 +1,504 @@
+"""Asyncio library for controlling one or many DJI Ryze Tello drones from a single event loop.
+"""
+
+import asyncio
+import inspect
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Callable
+
+from .tello import Tello, TelloException, BackgroundFrameRead
+from .state import StateDecoder
+
+
+class TelloDatagramProtocol(asyncio.DatagramProtocol):
+    """Receives datagrams on one local port and dispatches them to the
+    AsyncTello registered for the sender's address.
+    Internal class, you normally wouldn't use this yourself.
+    """
+
+    def __init__(self, callback_name: str):
+        self.callback_name = callback_name
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.drones: Dict[str, 'AsyncTello'] = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        drone = self.drones.get(address[0])
+        if drone is not None:
+            getattr(drone, self.callback_name)(data)
+
+    def error_received(self, exc):
+        Tello.LOGGER.error(exc)
+
+
+# Command and state endpoints shared by all drones of an event loop
+endpoints: Dict[asyncio.AbstractEventLoop, tuple] = {}
+
+
+async def get_endpoints():
+    """Bind the command and state ports once per event loop.
+    The ports are the same as the ones of the blocking Tello class,
+    so both can't be used in the same process.
+    Internal method, you normally wouldn't call this yourself.
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in endpoints:
+        _, command_protocol = await loop.create_datagram_endpoint(
+            lambda: TelloDatagramProtocol('response_received'), local_addr=('0.0.0.0', Tello.CONTROL_UDP_PORT))
+        _, state_protocol = await loop.create_datagram_endpoint(
+            lambda: TelloDatagramProtocol('state_received'), local_addr=('0.0.0.0', Tello.STATE_UDP_PORT))
+        endpoints[loop] = (command_protocol, state_protocol)
+    return endpoints[loop]
+
+
+class AsyncTello:
+    """Asyncio counterpart of [Tello][tello]. Commands are awaitable and never block
+    the event loop, so one loop can drive many drones next to a control loop.
+
+    ```python
+    tello = AsyncTello()
+    await tello.connect()
+    await tello.takeoff()
+    async for state in tello.states():
+        print(state['h'])
+    ```
+    """
+
+    RESPONSE_TIMEOUT = Tello.RESPONSE_TIMEOUT
+    TAKEOFF_TIMEOUT = Tello.TAKEOFF_TIMEOUT
+    TIME_BTW_COMMANDS = Tello.TIME_BTW_COMMANDS
+    TIME_BTW_RC_CONTROL_COMMANDS = Tello.TIME_BTW_RC_CONTROL_COMMANDS
+    STATE_QUEUE_SIZE = 1  # state packets buffered per states() iterator, oldest are dropped
+
+    LOGGER = Tello.LOGGER
+
+    def __init__(self,
+                 host=Tello.TELLO_IP,
+                 retry_count=Tello.RETRY_COUNT,
+                 vs_udp=Tello.VS_UDP_PORT):
+        self.address = (host, Tello.CONTROL_UDP_PORT)
+        self.retry_count = retry_count
+        self.vs_udp_port = vs_udp
+
+        self.command_protocol: Optional[TelloDatagramProtocol] = None
+        self.state_protocol: Optional[TelloDatagramProtocol] = None
+        self.command_lock = asyncio.Lock()
+        self.response_future: Optional[asyncio.Future] = None
+        self.last_response_timestamp = 0.0
+        self.last_rc_control_timestamp = 0.0
+
+        self.state = {}
+        self.state_decoder = StateDecoder()
+        self.state_queues: List[asyncio.Queue] = []
+
+        self.stream_on = False
+        self.stream_on_timestamp = None
+        self.is_flying = False
+        self.background_frame_read: Optional[BackgroundFrameRead] = None
+        # one thread per drone waits for its frames, see frames()
+        self.frame_executor: Optional[ThreadPoolExecutor] = None
+
+    async def open(self):
+        """Register this drone with the shared UDP endpoints.
+        Called by connect, you normally wouldn't call this yourself.
+        """
+        if self.command_protocol is None:
+            self.command_protocol, self.state_protocol = await get_endpoints()
+            self.command_protocol.drones[self.address[0]] = self
+            self.state_protocol.drones[self.address[0]] = self
+            self.LOGGER.info("AsyncTello instance was initialized. Host: '{}'. Port: '{}'."
+                             .format(self.address[0], Tello.CONTROL_UDP_PORT))
+
+    def response_received(self, data: bytes):
+        """Resolve the command waiting for a response. Responses without a waiting
+        command belong to commands that already timed out and are dropped.
+        Internal method, you normally wouldn't call this yourself.
+        """
+        if self.response_future is not None and not self.response_future.done():
+            self.response_future.set_result(data)
+
+    def state_received(self, data: bytes):
+        """Decode a state packet and hand it to every states() iterator.
+        Internal method, you normally wouldn't call this yourself.
+        """
+        try:
+            state = self.state_decoder.decode(data.decode('ASCII'))
+        except UnicodeDecodeError as e:
+            self.LOGGER.error(e)
+            return
+        if state is None:
+            return
+        self.state = state
+
+        for queue in self.state_queues:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(self.state)
+
+    async def send_command_with_return(self, command: str, timeout: float = RESPONSE_TIMEOUT) -> str:
+        """Send command to Tello and wait for its response.
+        Internal method, you normally wouldn't call this yourself.
+        Return:
+            str: response text, or an error message after a timeout
+        """
+        await self.open()
+
+        async with self.command_lock:
+            # Commands very consecutive makes the drone not respond to them.
+            remaining = self.TIME_BTW_COMMANDS - (time.time() - self.last_response_timestamp)
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+
+            self.LOGGER.info("Send command: '{}'".format(command))
+            self.response_future = asyncio.get_running_loop().create_future()
+            self.command_protocol.transport.sendto(command.encode('utf-8'), self.address)
+
+            try:
+                data = await asyncio.wait_for(self.response_future, timeout)
+            except asyncio.TimeoutError:
+                message = "Aborting command '{}'. Did not receive a response after {} seconds".format(command, timeout)
+                self.LOGGER.warn(message)
+                return message
+            finally:
+                self.response_future = None
+
+            self.last_response_timestamp = time.time()
+
+        try:
+            response = data.decode('utf-8')
+        except UnicodeDecodeError as e:
+            self.LOGGER.error(e)
+            return "response decode error"
+        response = response.rstrip("\r\n")
+
+        self.LOGGER.info("Response {}: '{}'".format(command, response))
+        return response
+
+    def send_command_without_return(self, command: str):
+        """Send command to Tello without expecting a response.
+        Internal method, you normally wouldn't call this yourself.
+        """
+        if self.command_protocol is None:
+            raise TelloException('Call connect() before sending commands')
+
+        self.LOGGER.info("Send command (no response expected): '{}'".format(command))
+        self.command_protocol.transport.sendto(command.encode('utf-8'), self.address)
+
+    async def send_control_command(self, command: str, timeout: float = RESPONSE_TIMEOUT) -> bool:
+        """Send control command to Tello and wait for its response.
+        Internal method, you normally wouldn't call this yourself.
+        """
+        response = "max retries exceeded"
+        for i in range(0, self.retry_count):
+            response = await self.send_command_with_return(command, timeout=timeout)
+
+            if 'ok' in response.lower():
+                return True
+
+            self.LOGGER.debug("Command attempt #{} failed for command: '{}'".format(i, command))
+
+        raise TelloException("Command '{}' was unsuccessful for {} tries. Latest response:\t'{}'"
+                             .format(command, 1 + self.retry_count, response))
+
+    async def send_read_command(self, command: str) -> str:
+        """Send given command to Tello and wait for its response.
+        Internal method, you normally wouldn't call this yourself.
+        """
+        response = await self.send_command_with_return(command)
+
+        if any(word in response for word in ('error', 'ERROR', 'False')):
+            raise TelloException("Command '{}' was unsuccessful. Latest response:\t'{}'".format(command, response))
+
+        return response
+
+    async def send_read_command_int(self, command: str) -> int:
+        return int(await self.send_read_command(command))
+
+    async def send_read_command_float(self, command: str) -> float:
+        return float(await self.send_read_command(command))
+
+    async def connect(self, wait_for_state=True):
+        """Enter SDK mode. Call this before any of the control functions.
+        """
+        await self.send_control_command("command")
+
+        if wait_for_state:
+            REPS = 20
+            for i in range(REPS):
+                if self.state:
+                    break
+                await asyncio.sleep(1 / REPS)
+
+            if not self.state:
+                raise TelloException('Did not receive a state packet from the Tello')
+
+    def get_current_state(self):
+        """Latest TelloState record.
+        """
+        return self.state
+
+    def get_state_field(self, key: str):
+        """Get a specific state field by name.
+        """
+        if key in self.state:
+            return self.state[key]
+        raise TelloException('Could not get state property: {}'.format(key))
+
+    async def states(self):
+        """Async iterator over TelloState records. A slow consumer only
+        skips packets, it never makes the receiver wait.
+
+        Every iterator gets its own queue, which is only removed when the
+        iterator is closed. Leaving an `async for` with `break` does not close
+        it, so wrap it in `contextlib.aclosing` or call `aclose()` yourself.
+
+        ```python
+        async with contextlib.aclosing(tello.states()) as states:
+            async for state in states:
+                if state['bat'] < 20:
+                    break
+        ```
+        """
+        await self.open()
+
+        queue: asyncio.Queue = asyncio.Queue(self.STATE_QUEUE_SIZE)
+        self.state_queues.append(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.state_queues.remove(queue)
+
+    async def get_frame_read(self, with_queue = False, max_queue_len = 32, decoder_options = None) -> BackgroundFrameRead:
+        """Start decoding the video stream. Opening the stream blocks,
+        so it happens in the default executor.
+        """
+        if self.background_frame_read is None:
+            options = Tello.get_default_decoder_options()
+            options.update(decoder_options or {})
+
+            address = 'udp://@{ip}:{port}'.format(ip=Tello.VS_UDP_IP, port=self.vs_udp_port)
+            loop = asyncio.get_running_loop()
+            self.background_frame_read = await loop.run_in_executor(
+                None, BackgroundFrameRead, self, address, with_queue, max_queue_len, options)
+            self.background_frame_read.start()
+        return self.background_frame_read
+
+    async def frames(self, poll_timeout: float = 0.5):
+        """Async iterator over new video frames as (seq, timestamp, frame).
+        Every decoded frame is yielded at most once, frames that arrive while
+        the consumer is busy are skipped. Waiting for a frame blocks, so every
+        drone waits in a thread of its own instead of the default executor,
+        which a large swarm would otherwise fill up.
+
+        ```python
+        async for seq, timestamp, frame in tello.frames():
+            detect(frame)
+        ```
+        """
+        frame_read = await self.get_frame_read()
+        loop = asyncio.get_running_loop()
+        if self.frame_executor is None:
+            self.frame_executor = ThreadPoolExecutor(1, thread_name_prefix='frames-{}'.format(self.address[0]))
+
+        seq = -1
+        while not frame_read.stopped:
+            newest = await loop.run_in_executor(self.frame_executor, frame_read.wait_for_frame, seq, poll_timeout)
+            if newest is None:
+                continue
+            seq = newest[0]
+            yield newest
+
+    async def takeoff(self):
+        """Automatic takeoff.
+        """
+        await self.send_control_command("takeoff", timeout=self.TAKEOFF_TIMEOUT)
+        self.is_flying = True
+
+    async def land(self):
+        """Automatic landing.
+        """
+        await self.send_control_command("land")
+        self.is_flying = False
+
+    def emergency(self):
+        """Stop all motors immediately.
+        """
+        self.send_command_without_return("emergency")
+        self.is_flying = False
+
+    async def streamon(self):
+        """Turn on video streaming. Use `frames()` afterwards.
+        """
+        if Tello.DEFAULT_VS_UDP_PORT != self.vs_udp_port:
+            await self.send_control_command('port 8890 {}'.format(self.vs_udp_port))
+        await self.send_control_command("streamon")
+        self.stream_on = True
+        self.stream_on_timestamp = time.time()
+
+    async def streamoff(self):
+        """Turn off video streaming.
+        """
+        await self.send_control_command("streamoff")
+        self.stream_on = False
+
+        if self.background_frame_read is not None:
+            self.background_frame_read.stop()
+
+        if self.frame_executor is not None:
+            # a pending wait returns within its poll timeout once the reader stopped
+            self.frame_executor.shutdown(wait=False)
+            self.frame_executor = None
+            self.background_frame_read = None
+
+    async def move(self, direction: str, x: int):
+        """Fly x cm in direction: up, down, left, right, forward or back.
+        """
+        await self.send_control_command("{} {}".format(direction, x))
+
+    async def move_up(self, x: int):
+        await self.move("up", x)
+
+    async def move_down(self, x: int):
+        await self.move("down", x)
+
+    async def move_left(self, x: int):
+        await self.move("left", x)
+
+    async def move_right(self, x: int):
+        await self.move("right", x)
+
+    async def move_forward(self, x: int):
+        await self.move("forward", x)
+
+    async def move_back(self, x: int):
+        await self.move("back", x)
+
+    async def rotate_clockwise(self, x: int):
+        await self.send_control_command("cw {}".format(x))
+
+    async def rotate_counter_clockwise(self, x: int):
+        await self.send_control_command("ccw {}".format(x))
+
+    async def go_xyz_speed(self, x: int, y: int, z: int, speed: int):
+        """Fly to x y z relative to the current position with speed in cm/s.
+        """
+        await self.send_control_command('go {} {} {} {}'.format(x, y, z, speed))
+
+    async def curve_xyz_speed(self, x1: int, y1: int, z1: int, x2: int, y2: int, z2: int, speed: int):
+        """Fly to x2 y2 z2 in a curve via x1 y1 z1, relative to the current position.
+        """
+        await self.send_control_command('curve {} {} {} {} {} {} {}'.format(x1, y1, z1, x2, y2, z2, speed))
+
+    async def set_speed(self, x: int):
+        await self.send_control_command("speed {}".format(x))
+
+    def send_rc_control(self, left_right_velocity: int, forward_backward_velocity: int, up_down_velocity: int,
+                        yaw_velocity: int):
+        """Send RC control via four channels, all -100~100. Does not wait for a response.
+        """
+        def clamp100(x: int) -> int:
+            return max(-100, min(100, x))
+
+        if time.time() - self.last_rc_control_timestamp > self.TIME_BTW_RC_CONTROL_COMMANDS:
+            self.last_rc_control_timestamp = time.time()
+            self.send_command_without_return('rc {} {} {} {}'.format(
+                clamp100(left_right_velocity),
+                clamp100(forward_backward_velocity),
+                clamp100(up_down_velocity),
+                clamp100(yaw_velocity)
+            ))
+
+    async def query_battery(self) -> int:
+        return await self.send_read_command_int('battery?')
+
+    async def end(self):
+        """Land, stop the stream and unregister from the shared endpoints.
+        """
+        try:
+            if self.is_flying:
+                await self.land()
+            if self.stream_on:
+                await self.streamoff()
+        except TelloException:
+            pass
+
+        if self.background_frame_read is not None:
+            self.background_frame_read.stop()
+
+        if self.frame_executor is not None:
+            # a pending wait returns within its poll timeout once the reader stopped
+            self.frame_executor.shutdown(wait=False)
+            self.frame_executor = None
+
+        if self.command_protocol is not None:
+            self.command_protocol.drones.pop(self.address[0], None)
+            self.state_protocol.drones.pop(self.address[0], None)
+
+
+class AsyncTelloSwarm:
+    """Control multiple AsyncTellos from one event loop. Parallel calls are
+    gathered, so no thread per drone and no barriers are needed.
+    """
+
+    def __init__(self, tellos: List[AsyncTello]):
+        self.tellos = tellos
+
+    @staticmethod
+    def fromIps(ips: list):
+        """Create AsyncTelloSwarm from a list of IP addresses.
+        """
+        if not ips:
+            raise TelloException("No ips provided")
+
+        return AsyncTelloSwarm([AsyncTello(ip.strip()) for ip in ips])
+
+    @staticmethod
+    def fromFile(path: str):
+        """Create AsyncTelloSwarm from file. The file should contain one IP address per line.
+        """
+        with open(path, 'r') as fd:
+            ips = fd.readlines()
+
+        return AsyncTelloSwarm.fromIps(ips)
+
+    async def sequential(self, func: Callable):
+        """Await `func(i, tello)` for each tello one after another.
+        """
+        return [await func(i, tello) for i, tello in enumerate(self.tellos)]
+
+    async def parallel(self, func: Callable):
+        """Await `func(i, tello)` for all tellos at the same time.
+        Returns once every drone is done, which doubles as the sync point.
+
+        ```python
+        await swarm.parallel(lambda i, tello: tello.move_up(50 + i * 10))
+        ```
+        """
+        return await asyncio.gather(*(func(i, tello) for i, tello in enumerate(self.tellos)))
+
+    def __getattr__(self, attr):
+        """Call an AsyncTello method on all tellos. Coroutine methods are gathered.
+
+        ```python
+        await swarm.connect()
+        await swarm.takeoff()
+        swarm.send_rc_control(0, 0, 0, 0)
+        ```
+        """
+        def callAll(*args, **kwargs):
+            results = [getattr(tello, attr)(*args, **kwargs) for tello in self.tellos]
+            if results and inspect.isawaitable(results[0]):
+                return asyncio.gather(*results)
+            return results
+
+        return callAll
+
+    def __iter__(self):
+        return iter(self.tellos)
+
+    def __len__(self):
+        return len(self.tellos)
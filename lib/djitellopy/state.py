@@ -0,0 +1,126 @@
+"""Compiled decoder turning Tello state packets into typed, timestamped records.
+"""
+
+import re
+import time
+from typing import Optional
+
+INT_STATE_FIELDS = (
+    # Tello EDU with mission pads enabled only
+    'mid', 'x', 'y', 'z',
+    # 'mpry': (custom format 'x,y,z')
+    # Common entries
+    'pitch', 'roll', 'yaw',
+    'vgx', 'vgy', 'vgz',
+    'templ', 'temph',
+    'tof', 'h', 'bat', 'time'
+)
+FLOAT_STATE_FIELDS = ('baro', 'agx', 'agy', 'agz')
+NUMERIC_STATE_FIELDS = INT_STATE_FIELDS + FLOAT_STATE_FIELDS
+
+STATE_FIELD_CONVERTERS = {key: int for key in INT_STATE_FIELDS}
+STATE_FIELD_CONVERTERS.update({key: float for key in FLOAT_STATE_FIELDS})
+
+# fields stored in TelloState slots, 'mpry' is kept as its raw 'x,y,z' string
+SLOT_FIELDS = NUMERIC_STATE_FIELDS + ('mpry',)
+
+
+class TelloState:
+    """One decoded state packet. Fields are slots, so a record holds no dict
+    per packet. Fields missing from the packet are None. The record can be read
+    like the dict the state used to be: `state['h']`, `'h' in state`.
+    Unknown fields end up as strings in `extra`.
+    """
+
+    __slots__ = NUMERIC_STATE_FIELDS + ('mpry', 'extra', 'timestamp', 'seq')
+
+    def __init__(self, timestamp: float = 0.0, seq: int = 0):
+        # field slots stay unset until decoded, reading goes through getattr with a default
+        self.extra = None
+        self.timestamp = timestamp
+        self.seq = seq
+
+    def __getitem__(self, key: str):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def __bool__(self) -> bool:
+        return any(getattr(self, name, None) is not None for name in NUMERIC_STATE_FIELDS)
+
+    def get(self, key: str, default=None):
+        if key in SLOT_FIELDS:
+            value = getattr(self, key, None)
+        elif self.extra is not None:
+            value = self.extra.get(key)
+        else:
+            value = None
+        return default if value is None else value
+
+    def keys(self) -> list:
+        keys = [name for name in SLOT_FIELDS if getattr(self, name, None) is not None]
+        if self.extra is not None:
+            keys.extend(self.extra)
+        return keys
+
+    def as_dict(self) -> dict:
+        return {key: self.get(key) for key in self.keys()}
+
+    def __repr__(self) -> str:
+        return 'TelloState(seq={}, timestamp={:.3f}, {})'.format(self.seq, self.timestamp, self.as_dict())
+
+
+class StateDecoder:
+    """Decodes state packets of one drone. The first packet fixes the field
+    layout and compiles it into a single regular expression, later packets are
+    matched in one call and converted with a precomputed converter per field.
+    Packets that don't fit the layout recompile it.
+    """
+
+    def __init__(self):
+        self.pattern: Optional[re.Pattern] = None
+        self.fields: tuple = ()
+        self.seq = 0
+
+    def compile(self, state: str):
+        """Build the pattern and field converters from the layout of a packet.
+        """
+        keys = [field.split(':', 1)[0] for field in state.split(';') if ':' in field]
+        self.pattern = re.compile(';'.join(re.escape(key) + ':([^;]*)' for key in keys) + ';?')
+        self.fields = tuple((key, STATE_FIELD_CONVERTERS.get(key, str), key in SLOT_FIELDS) for key in keys)
+
+    def decode(self, state: str, timestamp: Optional[float] = None) -> Optional[TelloState]:
+        """Decode a packet into a TelloState with the receive timestamp and a sequence number.
+        Returns:
+            TelloState, or None for packets without any field such as 'ok'
+        """
+        state = state.strip()
+
+        match = self.pattern.fullmatch(state) if self.pattern is not None else None
+        if match is None:
+            self.compile(state)
+            match = self.pattern.fullmatch(state) if self.fields else None
+            if match is None:
+                return None
+
+        record = TelloState(time.time() if timestamp is None else timestamp, self.seq)
+        self.seq += 1
+
+        for (key, converter, slot), value in zip(self.fields, match.groups()):
+            try:
+                value = converter(value)
+            except ValueError:
+                continue
+
+            if slot:
+                setattr(record, key, value)
+            else:
+                if record.extra is None:
+                    record.extra = {}
+                record.extra[key] = value
+
+        return record
@@ -0,0 +1,140 @@
+"""Fixed size history of the numeric state fields of one drone.
+"""
+
+from threading import Lock
+from typing import Optional, Tuple, Union, Sequence
+
+import numpy as np
+
+from .state import NUMERIC_STATE_FIELDS, TelloState
+
+Fields = Union[str, Sequence[str]]
+
+
+class TelemetryHistory:
+    """Ring buffer of the last `size` state packets, one row per packet and one
+    column per numeric field. Rows are written in place, so appending never
+    allocates or copies the history. Fields missing from a packet are NaN.
+    Queries take time windows in the same clock as TelloState.timestamp.
+
+    ```python
+    history = tello.get_state_history()
+    yaw_200ms_ago = history.at('yaw', time.time() - 0.2)
+    climb_rate = history.derivative('h', 1.0)
+    ```
+    """
+
+    FIELDS = NUMERIC_STATE_FIELDS
+
+    def __init__(self, size: int = 1024):
+        self.size = size
+        self.columns = {field: i for i, field in enumerate(self.FIELDS)}
+        self.values = np.full((size, len(self.FIELDS)), np.nan)
+        self.timestamps = np.zeros(size)
+        self.seqs = np.zeros(size, dtype=np.int64)
+        self.count = 0
+        self.lock = Lock()
+
+    def __len__(self) -> int:
+        return min(self.count, self.size)
+
+    def append(self, state: TelloState):
+        """Write a state record into the oldest row. Timestamps come from the
+        wall clock, which can be set back, so they are kept non-decreasing for
+        the binary searches in rows().
+        """
+        with self.lock:
+            row = self.count % self.size
+            timestamp = state.timestamp
+            if self.count:
+                timestamp = max(timestamp, self.timestamps[(self.count - 1) % self.size])
+            values = self.values[row]
+            for i, field in enumerate(self.FIELDS):
+                value = getattr(state, field, None)
+                values[i] = np.nan if value is None else value
+            self.timestamps[row] = timestamp
+            self.seqs[row] = state.seq
+            self.count += 1
+
+    def column_index(self, fields: Fields):
+        if isinstance(fields, str):
+            return self.columns[fields]
+        return [self.columns[field] for field in fields]
+
+    def rows(self, start: Optional[float] = None, end: Optional[float] = None) -> np.ndarray:
+        """Row indices in time order with start <= timestamp <= end.
+        Must be called with the lock held.
+        """
+        n = min(self.count, self.size)
+        order = (self.count - n + np.arange(n)) % self.size
+        timestamps = self.timestamps[order]
+
+        first = 0 if start is None else np.searchsorted(timestamps, start, side='left')
+        last = n if end is None else np.searchsorted(timestamps, end, side='right')
+        return order[first:last]
+
+    def window(self, fields: Fields, start: Optional[float] = None,
+               end: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Timestamps and values of fields between start and end.
+        Returns:
+            (timestamps, values), values has one column per field when fields is a list
+        """
+        columns = self.column_index(fields)
+        with self.lock:
+            rows = self.rows(start, end)
+            return self.timestamps[rows], self.values[rows][:, columns]
+
+    def latest_before(self, timestamp: float) -> Optional[dict]:
+        """The last record received at or before timestamp.
+        Returns:
+            dict with all numeric fields plus 'timestamp' and 'seq', None if there is none
+        """
+        with self.lock:
+            rows = self.rows(end=timestamp)
+            if len(rows) == 0:
+                return None
+            row = rows[-1]
+            record = dict(zip(self.FIELDS, self.values[row].tolist()))
+            record['timestamp'] = float(self.timestamps[row])
+            record['seq'] = int(self.seqs[row])
+            return record
+
+    def at(self, fields: Fields, timestamp: Union[float, np.ndarray]):
+        """Linearly interpolate fields at timestamp, which can also be an array
+        of timestamps, e.g. those of video frames. Clamped to the stored range.
+        """
+        times, values = self.window(fields)
+        if len(times) == 0:
+            raise ValueError('No telemetry recorded yet')
+
+        if values.ndim == 1:
+            return np.interp(timestamp, times, values)
+        return np.stack([np.interp(timestamp, times, values[:, i]) for i in range(values.shape[1])], axis=-1)
+
+    def mean(self, fields: Fields, duration: float, end: Optional[float] = None):
+        """Mean of fields over the last duration seconds before end (default: newest record).
+        """
+        start, end = self.span(duration, end)
+        _, values = self.window(fields, start, end)
+        return np.nanmean(values, axis=0)
+
+    def derivative(self, fields: Fields, duration: float, end: Optional[float] = None):
+        """Rate of change per second of fields over the last duration seconds,
+        from a least squares line fit so single noisy packets matter less.
+        """
+        start, end = self.span(duration, end)
+        times, values = self.window(fields, start, end)
+        if len(times) < 2:
+            return np.full(values.shape[1:], np.nan)
+
+        dt = times - times.mean()
+        denominator = np.dot(dt, dt)
+        if denominator == 0:
+            return np.full(values.shape[1:], np.nan)
+        return np.tensordot(dt, values - values.mean(axis=0), axes=1) / denominator
+
+    def span(self, duration: float, end: Optional[float]) -> Tuple[float, float]:
+        if end is None:
+            with self.lock:
+                end = float(self.timestamps[(self.count - 1) % self.size]) if self.count else 0.0
+        return end - duration, end
@@ -6,11 +6,13 @@ import logging
 import socket
 import time
 from collections import deque
-from threading import Thread, Lock
-from typing import Optional, Union, Type, Dict
+from threading import Thread, Lock, Condition, Event
+from typing import Optional, Union, Type, Dict, Tuple
 import logger
 
 from .enforce_types import enforce_types
+from .state import INT_STATE_FIELDS, FLOAT_STATE_FIELDS, StateDecoder
+from .telemetry import TelemetryHistory
 
 import av
 import numpy as np
@@ -25,6 +27,46 @@ class TelloException(Exception):
     pass
 
 
+class ResponseChannel:
+    """Per drone channel for command responses, filled by the response receiver thread.
+    The Tello protocol has no command ids, so commands to one drone are serialised
+    and a response is only matched to a command when it arrived after that command was sent.
+    Internal class, you normally wouldn't use this yourself.
+    """
+
+    def __init__(self):
+        self.condition = Condition()
+        self.responses: deque = deque()
+        self.command_lock = Lock()
+        self.last_response_timestamp = 0.0
+
+    def put(self, data: bytes):
+        """Store a response and wake up the waiting command.
+        """
+        with self.condition:
+            self.responses.append((time.time(), data))
+            self.condition.notify_all()
+
+    def wait_response(self, sent_timestamp: float, timeout: float) -> Optional[bytes]:
+        """Wait for the first response received after sent_timestamp.
+        Older responses belong to commands that already timed out and are dropped.
+        Returns:
+            bytes or None on timeout
+        """
+        deadline = time.time() + timeout
+        with self.condition:
+            while True:
+                while self.responses:
+                    timestamp, data = self.responses.popleft()
+                    if timestamp >= sent_timestamp:
+                        return data
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+
 @enforce_types
 class Tello:
     """Python wrapper to interact with the Ryze Tello drone using the official Tello api.
@@ -36,9 +78,20 @@ class Tello:
     RESPONSE_TIMEOUT = 7  # in seconds
     TAKEOFF_TIMEOUT = 20  # in seconds
     FRAME_GRAB_TIMEOUT = 5
+    FRAME_BUFFER_SIZE = 4  # number of decoded frames kept by BackgroundFrameRead
+
+    # Video decoder settings, override per stream with get_frame_read(decoder_options=...)
+    DECODER_THREAD_TYPE = 'SLICE'  # 'SLICE', 'FRAME' or 'AUTO'. Frame threading delays output by one frame per thread
+    DECODER_THREAD_COUNT = 0  # 0 lets the decoder pick
+    DECODER_LOW_DELAY = True
+    DECODER_SKIP_FRAME = 'default'  # 'none', 'default', 'noref', 'bidir', 'nointra', 'nokey' or 'all'
+    DECODER_SKIP_LOOP_FILTER = 'default'  # same values as DECODER_SKIP_FRAME
+    STREAM_PROBE_SIZE = 32 * 1024  # in bytes
+    STREAM_ANALYZE_DURATION = 0.5  # in seconds
     TIME_BTW_COMMANDS = 0.1  # in seconds
     TIME_BTW_RC_CONTROL_COMMANDS = 0.001  # in seconds
     RETRY_COUNT = 3  # number of retries after a failed command
+    TELEMETRY_HISTORY_SIZE = 1024  # state packets kept per drone, about 100 s at 10 Hz
     TELLO_IP = '192.168.10.1'  # Tello IP address
 
     # Video stream, server socket
@@ -71,18 +124,9 @@ class Tello:
     # Use Tello.LOGGER.setLevel(logging.<LEVEL>) in YOUR CODE
     # to only receive logs of the desired level and higher
 
-    # Conversion functions for state protocol fields
-    INT_STATE_FIELDS = (
-        # Tello EDU with mission pads enabled only
-        'mid', 'x', 'y', 'z',
-        # 'mpry': (custom format 'x,y,z')
-        # Common entries
-        'pitch', 'roll', 'yaw',
-        'vgx', 'vgy', 'vgz',
-        'templ', 'temph',
-        'tof', 'h', 'bat', 'time'
-    )
-    FLOAT_STATE_FIELDS = ('baro', 'agx', 'agy', 'agz')
+    # Conversion functions for state protocol fields, see state.py
+    INT_STATE_FIELDS = INT_STATE_FIELDS
+    FLOAT_STATE_FIELDS = FLOAT_STATE_FIELDS
 
     state_field_converters: Dict[str, Union[Type[int], Type[float]]]
     state_field_converters = {key : int for key in INT_STATE_FIELDS}
@@ -106,6 +150,7 @@ class Tello:
         self.retry_count = retry_count
         self.last_received_command_timestamp = time.time()
         self.last_rc_control_timestamp = time.time()
+        self.stream_on_timestamp = None
 
         if not threads_initialized:
             # Run Tello command responses UDP receiver on background
@@ -122,7 +167,8 @@ class Tello:
 
             threads_initialized = True
 
-        drones[host] = {'responses': [], 'state': {}}
+        drones[host] = {'responses': ResponseChannel(), 'state': {}, 'decoder': StateDecoder(),
+                        'history': TelemetryHistory(Tello.TELEMETRY_HISTORY_SIZE), 'recorder': None}
 
         self.LOGGER.info("Tello instance was initialized. Host: '{}'. Port: '{}'.".format(host, Tello.CONTROL_UDP_PORT))
 
@@ -135,6 +181,13 @@ class Tello:
         self.vs_udp_port = udp_port
         self.send_control_command(f'port 8890 {self.vs_udp_port}')
 
+    def set_flight_recorder(self, recorder):
+        """Record state packets and sent commands with their round trip times.
+        Arguments:
+            recorder: lib.recorder.FlightRecorder, or None to stop recording
+        """
+        self.get_own_udp_object()['recorder'] = recorder
+
     def get_own_udp_object(self):
         """Get own object from the global drones dict. This object is filled
         with responses and state information by the receiver threads.
@@ -156,12 +209,13 @@ class Tello:
                 data, address = client_socket.recvfrom(1024)
 
                 address = address[0]
-                Tello.LOGGER.debug('Data received from {} at client_socket'.format(address))
+                if Tello.LOGGER.enabled(logger.LOG_DEBUG):
+                    Tello.LOGGER.debug('Data received from {} at client_socket'.format(address))
 
                 if address not in drones:
                     continue
 
-                drones[address]['responses'].append(data)
+                drones[address]['responses'].put(data)
 
             except Exception as e:
                 Tello.LOGGER.error(e)
@@ -180,15 +234,22 @@ class Tello:
         while True:
             try:
                 data, address = state_socket.recvfrom(1024)
+                timestamp = time.time()
 
                 address = address[0]
-                Tello.LOGGER.debug('Data received from {} at state_socket'.format(address))
+                if Tello.LOGGER.enabled(logger.LOG_DEBUG):
+                    Tello.LOGGER.debug('Data received from {} at state_socket: {}'.format(address, data))
 
                 if address not in drones:
                     continue
 
-                data = data.decode('ASCII')
-                drones[address]['state'] = Tello.parse_state(data)
+                drone = drones[address]
+                state = drone['decoder'].decode(data.decode('ASCII'), timestamp)
+                if state is not None:
+                    drone['state'] = state
+                    drone['history'].append(state)
+                    if drone['recorder'] is not None:
+                        drone['recorder'].recordState(state)
 
             except Exception as e:
                 Tello.LOGGER.error(e)
@@ -196,11 +257,13 @@ class Tello:
 
     @staticmethod
     def parse_state(state: str) -> Dict[str, Union[int, float, str]]:
-        """Parse a state line to a dictionary
+        """Parse a state line to a dictionary. State packets go through the
+        faster StateDecoder, this is used for query responses.
         Internal method, you normally wouldn't call this yourself.
         """
         state = state.strip()
-        Tello.LOGGER.debug('Raw state data: {}'.format(state))
+        if Tello.LOGGER.enabled(logger.LOG_DEBUG):
+            Tello.LOGGER.debug('Raw state data: {}'.format(state))
 
         if state == 'ok':
             return {}
@@ -219,8 +282,9 @@ class Tello:
                 try:
                     value = num_type(value)
                 except ValueError as e:
-                    Tello.LOGGER.debug('Error parsing state value for {}: {} to {}'
-                                       .format(key, value, num_type))
+                    if Tello.LOGGER.enabled(logger.LOG_DEBUG):
+                        Tello.LOGGER.debug('Error parsing state value for {}: {} to {}'
+                                           .format(key, value, num_type))
                     Tello.LOGGER.error(e)
                     continue
 
@@ -228,9 +292,10 @@ class Tello:
 
         return state_dict
 
-    def get_current_state(self) -> dict:
-        """Call this function to attain the state of the Tello. Returns a dict
-        with all fields.
+    def get_current_state(self):
+        """Call this function to attain the state of the Tello. Returns the latest
+        TelloState record, which is read like a dict with all fields and also
+        carries the receive timestamp and sequence number.
         Internal method, you normally wouldn't call this yourself.
         """
         return self.get_own_udp_object()['state']
@@ -246,6 +311,22 @@ class Tello:
         else:
             raise TelloException('Could not get state property: {}'.format(key))
 
+    def get_state_history(self) -> TelemetryHistory:
+        """Get the ring buffer with the recent numeric state of the Tello.
+        Use it to look up or interpolate values at a given time, e.g. the
+        timestamp of a video frame, or for windowed means and rates.
+        Returns:
+            TelemetryHistory
+        """
+        return self.get_own_udp_object()['history']
+
+    def get_state_at(self, key: str, timestamp: float) -> float:
+        """Get a numeric state field interpolated at timestamp (seconds, time.time() clock).
+        Returns:
+            float: interpolated value
+        """
+        return float(self.get_state_history().at(key, timestamp))
+
     def get_mission_pad_id(self) -> int:
         """Mission pad ID of the currently detected mission pad
         Only available on Tello EDUs after calling enable_mission_pads
@@ -408,48 +489,79 @@ class Tello:
         address = address_schema.format(ip=self.VS_UDP_IP, port=self.vs_udp_port)
         return address
 
-    def get_frame_read(self, with_queue = False, max_queue_len = 32) -> 'BackgroundFrameRead':
+    @staticmethod
+    def get_default_decoder_options() -> dict:
+        """Decoder options used by get_frame_read, built from the DECODER_* and STREAM_* constants.
+        """
+        return {
+            'thread_type': Tello.DECODER_THREAD_TYPE,
+            'thread_count': Tello.DECODER_THREAD_COUNT,
+            'low_delay': Tello.DECODER_LOW_DELAY,
+            'skip_frame': Tello.DECODER_SKIP_FRAME,
+            'skip_loop_filter': Tello.DECODER_SKIP_LOOP_FILTER,
+            'probe_size': Tello.STREAM_PROBE_SIZE,
+            'analyze_duration': Tello.STREAM_ANALYZE_DURATION
+        }
+
+    def get_frame_read(self, with_queue = False, max_queue_len = 32, decoder_options = None) -> 'BackgroundFrameRead':
         """Get the BackgroundFrameRead object from the camera drone. Then, you just need to call
         backgroundFrameRead.frame to get the actual frame received by the drone.
+        Arguments:
+            decoder_options: dict overriding entries of get_default_decoder_options()
         Returns:
             BackgroundFrameRead
         """
         if self.background_frame_read is None:
+            options = Tello.get_default_decoder_options()
+            options.update(decoder_options or {})
+
             address = self.get_udp_video_address()
-            self.background_frame_read = BackgroundFrameRead(self, address, with_queue, max_queue_len)
+            self.background_frame_read = BackgroundFrameRead(self, address, with_queue, max_queue_len, options)
             self.background_frame_read.start()
         return self.background_frame_read
 
+    def get_time_to_first_frame(self) -> Optional[float]:
+        """Time between streamon and the first decoded video frame.
+        Returns:
+            float: seconds, None while no frame has been decoded yet
+        """
+        if self.background_frame_read is None:
+            return None
+        return self.background_frame_read.time_to_first_frame
+
     def send_command_with_return(self, command: str, timeout: int = RESPONSE_TIMEOUT) -> str:
         """Send command to Tello and wait for its response.
         Internal method, you normally wouldn't call this yourself.
         Return:
             bool/str: str with response text on success, False when unsuccessfull.
         """
-        # Commands very consecutive makes the drone not respond to them.
-        # So wait at least self.TIME_BTW_COMMANDS seconds
-        diff = time.time() - self.last_received_command_timestamp
-        if diff < self.TIME_BTW_COMMANDS:
-            self.LOGGER.debug('Waiting {} seconds to execute command: {}...'.format(diff, command))
-            time.sleep(diff)
+        channel = self.get_own_udp_object()['responses']
 
-        self.LOGGER.info("Send command: '{}'".format(command))
-        timestamp = time.time()
+        with channel.command_lock:
+            # Commands very consecutive makes the drone not respond to them.
+            # So wait at least self.TIME_BTW_COMMANDS seconds after the last response
+            remaining = self.TIME_BTW_COMMANDS - (time.time() - channel.last_response_timestamp)
+            if remaining > 0:
+                self.LOGGER.debug('Waiting {} seconds to execute command: {}...'.format(remaining, command))
+                time.sleep(remaining)
 
-        client_socket.sendto(command.encode('utf-8'), self.address)
+            self.LOGGER.info("Send command: '{}'".format(command))
+            timestamp = time.time()
 
-        responses = self.get_own_udp_object()['responses']
+            client_socket.sendto(command.encode('utf-8'), self.address)
 
-        while not responses:
-            if time.time() - timestamp > timeout:
+            first_response = channel.wait_response(timestamp, timeout)
+            recorder = self.get_own_udp_object()['recorder']
+            if first_response is None:
                 message = "Aborting command '{}'. Did not receive a response after {} seconds".format(command, timeout)
                 self.LOGGER.warn(message)
+                if recorder is not None:
+                    recorder.recordCommand(timestamp, command, message, float('nan'))
                 return message
-            time.sleep(0.1)  # Sleep during send command
 
-        self.last_received_command_timestamp = time.time()
+            channel.last_response_timestamp = time.time()
+            self.last_received_command_timestamp = channel.last_response_timestamp
 
-        first_response = responses.pop(0)  # first datum from socket
         try:
             response = first_response.decode("utf-8")
         except UnicodeDecodeError as e:
@@ -457,6 +569,9 @@ class Tello:
             return "response decode error"
         response = response.rstrip("\r\n")
 
+        if recorder is not None:
+            recorder.recordCommand(timestamp, command, response, self.last_received_command_timestamp - timestamp)
+
         self.LOGGER.info("Response {}: '{}'".format(command, response))
         return response
 
@@ -469,6 +584,10 @@ class Tello:
         self.LOGGER.info("Send command (no response expected): '{}'".format(command))
         client_socket.sendto(command.encode('utf-8'), self.address)
 
+        recorder = self.get_own_udp_object()['recorder']
+        if recorder is not None:
+            recorder.recordCommand(time.time(), command, '', float('nan'))
+
     def send_control_command(self, command: str, timeout: int = RESPONSE_TIMEOUT) -> bool:
         """Send control command to Tello and wait for its response.
         Internal method, you normally wouldn't call this yourself.
@@ -594,6 +713,7 @@ class Tello:
             self.change_vs_udp(self.vs_udp_port)
         self.send_control_command("streamon")
         self.stream_on = True
+        self.stream_on_timestamp = time.time()
 
     def streamoff(self):
         """Turn off video streaming.
@@ -1028,47 +1148,146 @@ class Tello:
         self.end()
 
 
+class FrameBuffer:
+    """
+    Ring of the most recently decoded frames. Every frame gets a sequence
+    number and the time it was decoded, so consumers can wait for a frame
+    newer than the one they processed last instead of polling.
+    Frames are handed out without copying. The decoder never writes into a
+    frame that was already published, so a returned frame stays valid.
+    """
+
+    def __init__(self, size: int = 4):
+        self.size = size
+        self.frames: list = [None] * size
+        self.timestamps = [0.0] * size
+        self.seq = -1
+        self.condition = Condition()
+
+    def put(self, frame, timestamp: float) -> int:
+        """Publish a new frame and wake up all waiting consumers.
+        Returns:
+            int: sequence number of the frame
+        """
+        with self.condition:
+            seq = self.seq + 1
+            slot = seq % self.size
+            self.frames[slot] = frame
+            self.timestamps[slot] = timestamp
+            self.seq = seq
+            self.condition.notify_all()
+        return seq
+
+    def latest(self) -> Tuple[int, float, Optional[np.ndarray]]:
+        """Get the newest frame.
+        Returns:
+            (seq, timestamp, frame), seq is -1 and frame None before the first frame
+        """
+        with self.condition:
+            slot = self.seq % self.size
+            return self.seq, self.timestamps[slot], self.frames[slot]
+
+    def wait_newer(self, seq: int, timeout: Optional[float] = None) -> Optional[Tuple[int, float, np.ndarray]]:
+        """Block until a frame with a sequence number above seq is available.
+        Returns:
+            (seq, timestamp, frame) of the newest frame, None on timeout
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.seq > seq, timeout):
+                return None
+            slot = self.seq % self.size
+            return self.seq, self.timestamps[slot], self.frames[slot]
+
+
 class BackgroundFrameRead:
     """
     This class read frames using PyAV in background. Use
     backgroundFrameRead.frame to get the current frame.
     """
 
-    def __init__(self, tello, address, with_queue = False, maxsize = 32):
+    def __init__(self, tello, address, with_queue = False, maxsize = 32, decoder_options = None):
         self.address = address
+        self.decoder_options = decoder_options or Tello.get_default_decoder_options()
         self.lock = Lock()
-        self.frame = np.zeros([300, 400, 3], dtype=np.uint8)
+        self.blank_frame = np.zeros([300, 400, 3], dtype=np.uint8)
+        self.buffer = FrameBuffer(Tello.FRAME_BUFFER_SIZE)
         self.frames = deque([], maxsize)
         self.with_queue = with_queue
 
+        # Measure the time to the first frame from streamon when possible
+        self.start_timestamp = tello.stream_on_timestamp or time.time()
+        self.time_to_first_frame: Optional[float] = None
+        self.first_frame_event = Event()
+
         # Try grabbing frame with PyAV
         # According to issue #90 the decoder might need some time
         # https://github.com/damiafuentes/DJITelloPy/issues/90#issuecomment-855458905
         try:
             Tello.LOGGER.debug('trying to grab video frames...')
-            self.container = av.open(self.address, timeout=(Tello.FRAME_GRAB_TIMEOUT, None))
+            options = self.decoder_options
+            self.container = av.open(self.address, timeout=(Tello.FRAME_GRAB_TIMEOUT, None), options={
+                'probesize': str(int(options['probe_size'])),
+                'analyzeduration': str(int(options['analyze_duration'] * 1000000))
+            })
         except av.error.ExitError:
             raise TelloException('Failed to grab video frames from video stream')
 
+        self.setup_decoder()
+
         self.stopped = False
         self.worker = Thread(target=self.update_frame, args=(), daemon=True)
 
+    def setup_decoder(self):
+        """Apply threading, low delay and skip options to the video decoder.
+        The codec options take effect when PyAV opens the decoder on the first packet.
+        Internal method, you normally wouldn't call this yourself.
+        """
+        options = self.decoder_options
+        stream = self.container.streams.video[0]
+        stream.thread_type = options['thread_type']
+        stream.thread_count = options['thread_count']
+
+        codec_options = {}
+        if options['low_delay']:
+            codec_options['flags'] = 'low_delay'
+        if options['skip_frame'] != 'default':
+            codec_options['skip_frame'] = options['skip_frame']
+        if options['skip_loop_filter'] != 'default':
+            codec_options['skip_loop_filter'] = options['skip_loop_filter']
+        stream.codec_context.options = codec_options
+
     def start(self):
         """Start the frame update worker
         Internal method, you normally wouldn't call this yourself.
         """
         self.worker.start()
 
+    def wait_first_frame(self, timeout: Optional[float] = None) -> Optional[float]:
+        """Block until the first frame has been decoded.
+        Returns:
+            float: time to first frame in seconds, None on timeout
+        """
+        self.first_frame_event.wait(timeout)
+        return self.time_to_first_frame
+
     def update_frame(self):
         """Thread worker function to retrieve frames using PyAV
         Internal method, you normally wouldn't call this yourself.
         """
         try:
             for frame in self.container.decode(video=0):
+                # Convert straight to a BGR ndarray, skipping the intermediate PIL image
+                image = frame.to_ndarray(format='bgr24')
+                if not self.first_frame_event.is_set():
+                    self.time_to_first_frame = time.time() - self.start_timestamp
+                    Tello.LOGGER.info('First video frame after {:.3f} seconds'.format(self.time_to_first_frame))
+                    self.first_frame_event.set()
+
                 if self.with_queue:
-                    self.frames.append(np.array(frame.to_image()))
+                    with self.lock:
+                        self.frames.append(image)
                 else:
-                    self.frame = np.array(frame.to_image())
+                    self.buffer.put(image, time.time())
 
                 if self.stopped:
                     self.container.close()
@@ -1089,18 +1308,27 @@ class BackgroundFrameRead:
     @property
     def frame(self):
         """
-        Access the frame variable directly
+        Access the newest frame directly
         """
         if self.with_queue:
             return self.get_queued_frame()
 
-        with self.lock:
-            return self._frame
+        _, _, frame = self.buffer.latest()
+        return self.blank_frame if frame is None else frame
 
-    @frame.setter
-    def frame(self, value):
-        with self.lock:
-            self._frame = value
+    @property
+    def frame_seq(self) -> int:
+        """
+        Sequence number of the newest frame, -1 before the first frame
+        """
+        return self.buffer.seq
+
+    def wait_for_frame(self, after_seq: int = -1, timeout: Optional[float] = None):
+        """Wait for a frame newer than after_seq without busy polling.
+        Returns:
+            (seq, timestamp, frame) or None when no new frame arrived within timeout
+        """
+        return self.buffer.wait_newer(after_seq, timeout)
 
     def stop(self):
         """Stop the frame update worker
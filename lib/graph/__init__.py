@@ -1,5 +1,7 @@
 from lib.graph.edge import Edge
 from lib.graph.node import Node
 from lib.graph.graph import Graph
+from lib.graph.compact import CompactGraph
+from lib.graph.planner import Planner
 
-__all__ = ["Edge", "Node", "Graph"]
\ No newline at end of file
+__all__ = ["Edge", "Node", "Graph", "CompactGraph", "Planner"]
\ No newline at end of file
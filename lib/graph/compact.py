@@ -0,0 +1,71 @@
+import numpy as np
+from . import Node, Graph
+from .loader import loadGraph
+
+class CompactGraph:
+    def __init__(self, ids: np.ndarray, coords: np.ndarray, frm: np.ndarray, to: np.ndarray, weights: np.ndarray) -> None:
+        self.ids = np.asarray(ids)
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+        # node id -> row of ids and coords
+        self.index = {id: i for i, id in enumerate(self.ids.tolist())}
+        if len(self.index) != len(self.ids):
+            raise Exception("Node ids are not unique.")
+
+        # CSR adjacency, the edges of node i are indices/weights[indptr[i]:indptr[i+1]]
+        frm = np.asarray(frm, dtype=np.int64)
+        order = np.argsort(frm, kind='stable')
+        self.indices = np.asarray(to, dtype=np.int64)[order]
+        self.weights = np.asarray(weights, dtype=np.float64)[order]
+        self.indptr = np.zeros(len(self.ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(frm, minlength=len(self.ids)), out=self.indptr[1:])
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __str__(self) -> str:
+        return str(self.toGraph())
+
+    def getIndex(self, id: object) -> int:
+        if id not in self.index:
+            raise Exception(f"Id: {id} does not exist in graph.")
+        return self.index[id]
+
+    def getId(self, i: int) -> object:
+        return self.ids[i].item()
+
+    def getEdgeCount(self) -> int:
+        return len(self.indices)
+
+    # Rows and weights of the edges leaving row i
+    def getNeighbours(self, i: int) -> tuple[np.ndarray, np.ndarray]:
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return self.indices[start:end], self.weights[start:end]
+
+    # Rows of the start node of every edge, in the order of indices and weights
+    def getSources(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self.ids)), np.diff(self.indptr))
+
+    @staticmethod
+    def make(nodefile: str, edgefile: str, cache: bool=True) -> "CompactGraph":
+        graph = loadGraph(nodefile, edgefile, cache)
+        return CompactGraph(graph['ids'], graph['coords'], graph['frm'], graph['to'], graph['weights'])
+
+    @staticmethod
+    def fromGraph(graph: Graph) -> "CompactGraph":
+        nodes = graph.getNodes()
+        index = {id: i for i, id in enumerate(nodes.keys())}
+        coords = [[float(n.getX()), float(n.getY()), float(n.getZ())] for n in nodes.values()]
+        frm, to, weights = [], [], []
+        for i, node in enumerate(nodes.values()):
+            for edge in node.getEdges():
+                frm.append(i)
+                to.append(index[edge.getTo().getId()])
+                weights.append(float(edge.getWeight()))
+        return CompactGraph(np.array(list(nodes.keys())), np.array(coords).reshape(-1, 3), frm, to, weights)
+
+    def toGraph(self) -> Graph:
+        nodes = [Node(self.getId(i), *self.coords[i].tolist()) for i in range(len(self))]
+        sources = self.getSources()
+        for i, j, w in zip(sources.tolist(), self.indices.tolist(), self.weights.tolist()):
+            nodes[i].addEdge(nodes[j], w)
+        return Graph(nodes)
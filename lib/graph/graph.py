@@ -1,6 +1,5 @@
-import typing
 from . import Node
-from collections.abc import Callable
+from .loader import loadGraph
 
 class Graph:
     def __init__(self, nodes: list[Node]=[]) -> None:
@@ -50,27 +49,9 @@ class Graph:
             self.nodes[id] = node
 
     @staticmethod
-    def make(nodefile, edgefile):
-        nodes: dict = {}
-        parseFile(nodefile, setupNodes, nodes)
-        parseFile(edgefile, setupEdges, nodes)
-        return Graph(nodes.values())
-
-def parseFile(file_path: str, func: Callable[..., None], *args: typing.Any) -> None:
-    with open(file_path) as f:
-        f.readline()
-        line = f.readline()
-        while line:
-            split = line.split()
-            func(split, args)
-            line = f.readline()
-
-def setupNodes(split: str, nodes: tuple) -> None:
-    if len(nodes) != 1 or not isinstance(nodes[0], dict):
-        raise Exception("Invalid argument for setting up nodes.")
-    nodes[0][split[0]] = (Node(split[0], split[1], split[2], split[3]))
-
-def setupEdges(split: str, nodes: tuple) -> None:
-    if len(nodes) != 1 or not isinstance(nodes[0], dict):
-        raise Exception("Invalid argument for setting up edges.")
-    nodes[0][split[0]].addEdge(nodes[0][split[1]], split[2])
\ No newline at end of file
+    def make(nodefile: str, edgefile: str, cache: bool=True) -> "Graph":
+        graph = loadGraph(nodefile, edgefile, cache)
+        nodes = [Node(id, x, y, z) for id, (x, y, z) in zip(graph['ids'].tolist(), graph['coords'].tolist())]
+        for i, j, w in zip(graph['frm'].tolist(), graph['to'].tolist(), graph['weights'].tolist()):
+            nodes[i].addEdge(nodes[j], w)
+        return Graph(nodes)
\ No newline at end of file
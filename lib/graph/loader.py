@@ -0,0 +1,137 @@
+import os
+import numpy as np
+
+NODE_DTYPE = np.dtype([('id', np.int64), ('x', np.float64), ('y', np.float64), ('z', np.float64)])
+EDGE_DTYPE = np.dtype([('frm', np.int64), ('to', np.int64), ('w', np.float64)])
+
+# arrays of a loaded graph, edges refer to nodes by row
+ARRAYS = ('ids', 'coords', 'frm', 'to', 'weights')
+
+# Cache of the node and edge files, stored next to the node file
+def getCachePath(nodefile: str, edgefile: str) -> str:
+    nodes = os.path.splitext(os.path.basename(nodefile))[0]
+    edges = os.path.splitext(os.path.basename(edgefile))[0]
+    return os.path.join(os.path.dirname(nodefile), f"{nodes}.{edges}.graph.npz")
+
+# Modification time (ns) and size of every file, a cache is valid while they match
+def getSignature(*paths: str) -> np.ndarray:
+    signature = []
+    for path in paths:
+        stat = os.stat(path)
+        signature.append([stat.st_mtime_ns, stat.st_size])
+    return np.array(signature, dtype=np.int64)
+
+# Data lines without comments and their line numbers in the file, the first line is the header
+def readLines(file_path: str) -> tuple[list[str], np.ndarray]:
+    with open(file_path) as f:
+        lines = f.read().splitlines()
+    data, numbers = [], []
+    for number, line in enumerate(lines[1:], start=2):
+        line = line.split('#', 1)[0]
+        if line.strip():
+            data.append(line)
+            numbers.append(number)
+    return data, np.array(numbers, dtype=np.int64)
+
+# Rows of a file in one loadtxt call and their line numbers. When that fails every line
+# is checked on its own, malformed ones are added to errors and left out.
+def readTable(file_path: str, dtype: np.dtype, errors: list) -> tuple[np.ndarray, np.ndarray]:
+    lines, numbers = readLines(file_path)
+    if not lines:
+        # only a header, loadtxt would warn about the missing data
+        return np.zeros(0, dtype=dtype), numbers
+    try:
+        return np.loadtxt(lines, dtype=dtype, ndmin=1), numbers
+    except ValueError:
+        pass
+
+    rows, valid = [], []
+    for line, number in zip(lines, numbers.tolist()):
+        split = line.split()
+        if len(split) != len(dtype.names):
+            errors.append((file_path, number, f"expected {len(dtype.names)} columns, found {len(split)}"))
+            continue
+        row = []
+        for name, value in zip(dtype.names, split):
+            convert = int if np.issubdtype(dtype[name], np.integer) else float
+            try:
+                row.append(convert(value))
+            except ValueError:
+                errors.append((file_path, number, f"{name} '{value}' is not {'an int' if convert is int else 'a number'}"))
+                break
+        else:
+            rows.append(tuple(row))
+            valid.append(number)
+    return np.array(rows, dtype=dtype), np.array(valid, dtype=np.int64)
+
+# Parse both files in bulk, every invalid line is reported in one Exception
+def parseGraph(nodefile: str, edgefile: str) -> dict:
+    errors = []
+    nodes, node_lines = readTable(nodefile, NODE_DTYPE, errors)
+    edges, edge_lines = readTable(edgefile, EDGE_DTYPE, errors)
+    ids = nodes['id']
+
+    # every definition after the first of an id
+    order = np.argsort(ids, kind='stable')
+    sorted_ids = ids[order]
+    repeated = order[1:][sorted_ids[1:] == sorted_ids[:-1]]
+    for k in repeated.tolist():
+        errors.append((nodefile, node_lines[k], f"node {ids[k]} is defined more than once"))
+
+    # rows of the endpoints, found by binary search in the sorted ids
+    rows = []
+    for column in ('frm', 'to'):
+        position = np.clip(np.searchsorted(sorted_ids, edges[column]), 0, max(len(ids) - 1, 0))
+        found = sorted_ids[position] == edges[column] if len(ids) else np.zeros(len(edges), dtype=bool)
+        for k in np.flatnonzero(~found).tolist():
+            errors.append((edgefile, edge_lines[k], f"edge {edges['frm'][k]} -> {edges['to'][k]} "
+                                                    f"has unknown node {edges[column][k]}"))
+        rows.append(order[position] if len(ids) else position)
+
+    for k in np.flatnonzero(~np.isfinite(edges['w'])).tolist():
+        errors.append((edgefile, edge_lines[k], f"edge {edges['frm'][k]} -> {edges['to'][k]} has weight {edges['w'][k]}"))
+
+    if errors:
+        errors.sort(key=lambda error: (error[0] != nodefile, error[1]))
+        raise Exception(f"Invalid graph, {len(errors)} errors:\n" +
+                        '\n'.join(f"{file}:{line}: {message}" for file, line, message in errors))
+
+    return {
+        'ids': ids,
+        'coords': np.stack([nodes['x'], nodes['y'], nodes['z']], axis=1),
+        'frm': rows[0].astype(np.int64),
+        'to': rows[1].astype(np.int64),
+        'weights': edges['w'],
+    }
+
+# Returns None if there is no cache or it is older than the files
+def readCache(path: str, signature: np.ndarray) -> dict | None:
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            if not np.array_equal(data['signature'], signature):
+                return None
+            return {name: data[name] for name in ARRAYS}
+    except (OSError, ValueError, KeyError):
+        return None
+
+def writeCache(path: str, signature: np.ndarray, arrays: dict) -> None:
+    # a cache that cannot be written only costs the next startup a parse
+    try:
+        np.savez(path, signature=signature, **arrays)
+    except OSError:
+        pass
+
+# Arrays of the graph in the files, from the cache next to them when it is up to date
+def loadGraph(nodefile: str, edgefile: str, cache: bool=True) -> dict:
+    if not cache:
+        return parseGraph(nodefile, edgefile)
+
+    path = getCachePath(nodefile, edgefile)
+    signature = getSignature(nodefile, edgefile)
+    arrays = readCache(path, signature)
+    if arrays is None:
+        arrays = parseGraph(nodefile, edgefile)
+        writeCache(path, signature, arrays)
+    return arrays
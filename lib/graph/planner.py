@@ -0,0 +1,180 @@
+import os
+import math
+import heapq
+import hashlib
+import numpy as np
+from . import Graph
+from .compact import CompactGraph
+from config import CONFIG
+
+GRAPH_SCALE = CONFIG['Graph']['scale']
+GRAPH_SPEED = CONFIG['Graph']['speed']
+
+# limits of go_xyz_speed in cm, a move must leave the MIN_MOVE box in at least one axis
+MAX_MOVE = 500
+MIN_MOVE = 20
+
+def hashFiles(*paths: str) -> str:
+    sha = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                sha.update(chunk)
+        # keep the boundary between files in the hash
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+class Planner:
+    def __init__(self, graph: Graph | CompactGraph) -> None:
+        if isinstance(graph, Graph):
+            graph = CompactGraph.fromGraph(graph)
+        self.graph = graph
+        self.ids = graph.ids.tolist()
+        self.index = graph.index
+        self.coords = graph.coords
+
+        # all pairs tables, see precompute
+        self.dist = None
+        self.next = None
+
+    # Planner for the graph in the files, with the all pairs tables read from or written to
+    # a cache in cache_dir (next to nodefile by default) keyed by the hash of both files
+    @staticmethod
+    def make(nodefile: str, edgefile: str, cache_dir: str | None=None) -> "Planner":
+        planner = Planner(CompactGraph.make(nodefile, edgefile))
+        key = hashFiles(nodefile, edgefile)
+        if cache_dir is None:
+            cache_dir = os.path.dirname(nodefile)
+        path = os.path.join(cache_dir, f"paths_{key[:16]}.npz")
+        if not planner.loadTables(path, key):
+            planner.precompute()
+            planner.saveTables(path, key)
+        return planner
+
+    def getIndex(self, id: object) -> int:
+        return self.graph.getIndex(id)
+
+    # Straight line distance, a lower bound of the path length as long as no
+    # edge weighs less than the distance between its nodes
+    def heuristic(self, i: int, j: int) -> float:
+        return float(np.linalg.norm(self.coords[i] - self.coords[j]))
+
+    def dijkstra(self, start: object, goal: object) -> tuple[list, float]:
+        return self.search(start, goal, lambda i, j: 0.)
+
+    def aStar(self, start: object, goal: object) -> tuple[list, float]:
+        return self.search(start, goal, self.heuristic)
+
+    # Node ids of the shortest path and its length, ([], inf) if goal cannot be reached
+    def search(self, start: object, goal: object, heuristic) -> tuple[list, float]:
+        s, g = self.getIndex(start), self.getIndex(goal)
+        dist = {s: 0.}
+        previous = {s: None}
+        done = set()
+        heap = [(heuristic(s, g), s)]
+        while heap:
+            _, i = heapq.heappop(heap)
+            if i in done:
+                continue
+            if i == g:
+                return self.tracePath(previous, g), dist[g]
+            done.add(i)
+            indices, weights = self.graph.getNeighbours(i)
+            for j, w in zip(indices.tolist(), weights.tolist()):
+                d = dist[i] + w
+                if j not in done and d < dist.get(j, math.inf):
+                    dist[j] = d
+                    previous[j] = i
+                    heapq.heappush(heap, (d + heuristic(j, g), j))
+        return [], math.inf
+
+    def tracePath(self, previous: dict, g: int) -> list:
+        path = []
+        i = g
+        while i is not None:
+            path.append(self.ids[i])
+            i = previous[i]
+        return path[::-1]
+
+    # Floyd-Warshall over distance and next hop tables, one vectorized relaxation per node
+    def precompute(self) -> None:
+        n = len(self.ids)
+        dist = np.full((n, n), np.inf)
+        hops = np.full((n, n), -1, dtype=np.int64)
+        sources = self.graph.getSources()
+        # the lightest of parallel edges
+        np.minimum.at(dist, (sources, self.graph.indices), self.graph.weights)
+        connected = np.isfinite(dist)
+        hops[connected] = np.nonzero(connected)[1]
+        diagonal = np.arange(n)
+        dist[diagonal, diagonal] = 0.
+        hops[diagonal, diagonal] = diagonal
+
+        for k in range(n):
+            via = dist[:, k, None] + dist[None, k, :]
+            better = via < dist
+            dist = np.where(better, via, dist)
+            hops = np.where(better, hops[:, k, None], hops)
+
+        self.dist = dist
+        self.next = hops
+
+    def saveTables(self, path: str, key: str) -> None:
+        np.savez(path, key=key, ids=np.array([str(id) for id in self.ids]), dist=self.dist, next=self.next)
+
+    # Returns False if there is no cache for this graph
+    def loadTables(self, path: str, key: str) -> bool:
+        if not os.path.exists(path):
+            return False
+        with np.load(path) as data:
+            if str(data['key']) != key or data['ids'].tolist() != [str(id) for id in self.ids]:
+                return False
+            self.dist = data['dist']
+            self.next = data['next']
+        return True
+
+    def hasTables(self) -> bool:
+        return self.dist is not None
+
+    # Length of the shortest path from the tables, inf if goal cannot be reached
+    def getDistance(self, start: object, goal: object) -> float:
+        if not self.hasTables():
+            raise Exception("Tables are not computed, call precompute first.")
+        return float(self.dist[self.getIndex(start), self.getIndex(goal)])
+
+    # Node ids of the shortest path from the tables, one lookup per hop
+    def getPath(self, start: object, goal: object) -> list:
+        if not self.hasTables():
+            raise Exception("Tables are not computed, call precompute first.")
+        i, g = self.getIndex(start), self.getIndex(goal)
+        if self.next[i, g] < 0:
+            return []
+        path = [self.ids[i]]
+        while i != g:
+            i = int(self.next[i, g])
+            path.append(self.ids[i])
+        return path
+
+    # go_xyz_speed arguments flying along path, the graph axes are taken as the
+    # drone's x/y/z at the start and scale converts graph units to cm. Long edges are
+    # split into moves of at most MAX_MOVE, nodes closer than MIN_MOVE are merged
+    # into the next move since the drone cannot fly them.
+    def getMoves(self, path: list, speed: int=GRAPH_SPEED, scale: float=GRAPH_SCALE) -> list[tuple[int, int, int, int]]:
+        moves = []
+        if len(path) < 2:
+            return moves
+        points = np.rint(self.coords[[self.getIndex(id) for id in path]] * scale).astype(np.int64)
+        position = points[0]
+        for point in points[1:]:
+            delta = point - position
+            if np.all(np.abs(delta) < MIN_MOVE):
+                continue
+            steps = max(1, math.ceil(np.max(np.abs(delta)) / MAX_MOVE))
+            previous = position
+            for k in range(1, steps + 1):
+                target = position + np.rint(delta * k / steps).astype(np.int64)
+                x, y, z = (target - previous).tolist()
+                moves.append((x, y, z, speed))
+                previous = target
+            position = point
+        return moves
@@ -0,0 +1,5 @@
+from lib.recorder.stream import ColumnStream
+from lib.recorder.recorder import FlightRecorder
+from lib.recorder.reader import FlightReader
+
+__all__ = ["ColumnStream", "FlightRecorder", "FlightReader"]
\ No newline at end of file
@@ -0,0 +1,69 @@
+import os
+import json
+import numpy as np
+from lib.recorder.recorder import STREAMS, getSchema
+
+class FlightReader:
+    """ Reads flights written by FlightRecorder. Only chunks overlapping the
+        requested time range are opened, and those are memory mapped.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def getStreams(self) -> list[str]:
+        return sorted(name for name in os.listdir(self.path)
+                      if os.path.isfile(os.path.join(self.path, name, 'index.json')))
+
+    def getIndex(self, name: str) -> list[dict]:
+        """ Chunks of a stream, empty when no row of it was ever written.
+        """
+        path = os.path.join(self.path, name, 'index.json')
+        if not os.path.isfile(path):
+            return []
+        with open(path) as f:
+            return json.load(f)
+
+    def getSchema(self, name: str) -> dict:
+        """ Column name -> [dtype string, row shape] of a stream, recordings without
+            columns.json fall back to the default streams of FlightRecorder.
+        """
+        path = os.path.join(self.path, name, 'columns.json')
+        if os.path.isfile(path):
+            with open(path) as f:
+                return json.load(f)
+        return getSchema(STREAMS.get(name, {}))
+
+    def empty(self, name: str, columns: list[str]=None) -> dict:
+        schema = self.getSchema(name)
+        names = columns if columns is not None else list(schema)
+        result = {}
+        for col in names:
+            dtype, shape = schema.get(col, ['<f8', []])
+            result[col] = np.zeros((0,) + tuple(shape), dtype=dtype)
+        return result
+
+    def load(self, name: str, start: float=None, end: float=None, columns: list[str]=None) -> dict:
+        """ Load the rows of a stream with start <= t <= end.
+            Returns a dict of column name -> array, with empty arrays when no row matches.
+        """
+        start = -np.inf if start is None else start
+        end = np.inf if end is None else end
+
+        parts = {}
+        for entry in self.getIndex(name):
+            if entry['t_max'] < start or entry['t_min'] > end:
+                continue
+
+            directory = os.path.join(self.path, name, f"{entry['chunk']:06d}")
+            t = np.load(os.path.join(directory, 't.npy'), mmap_mode='r')
+            mask = (t >= start) & (t <= end)
+
+            names = columns if columns is not None else [f[:-4] for f in os.listdir(directory) if f.endswith('.npy')]
+            for col in names:
+                values = np.load(os.path.join(directory, f"{col}.npy"), mmap_mode='r')
+                parts.setdefault(col, []).append(values[mask])
+
+        if not parts:
+            return self.empty(name, columns)
+        return {col: np.concatenate(values) for col, values in parts.items()}
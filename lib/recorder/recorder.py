@@ -0,0 +1,135 @@
+import os
+import json
+import math
+import queue
+import threading
+import numpy as np
+from lib.recorder.stream import ColumnStream
+from lib.djitellopy.state import NUMERIC_STATE_FIELDS
+
+STATE_COLUMNS = {'t': np.float64, 'seq': np.int64}
+STATE_COLUMNS.update({field: np.float64 for field in NUMERIC_STATE_FIELDS})
+
+COMMAND_COLUMNS = {
+    't': np.float64,
+    # any length, written as strings as wide as the longest in the chunk
+    'command': object,
+    'response': object,
+    'rtt': np.float64
+}
+
+DETECTION_COLUMNS = {
+    't': np.float64,
+    'frame_seq': np.int64,
+    'marker_id': np.int64,
+    'rvec': (np.float64, (3,)),
+    'tvec': (np.float64, (3,))
+}
+
+# streams every recording has
+STREAMS = {'state': STATE_COLUMNS, 'commands': COMMAND_COLUMNS, 'detections': DETECTION_COLUMNS}
+
+# dtype string and row shape of every column, object columns are written as strings
+def getSchema(columns: dict) -> dict:
+    schema = {}
+    for col, spec in columns.items():
+        dtype, shape = spec if isinstance(spec, tuple) else (spec, ())
+        dtype = np.dtype(str) if np.dtype(dtype) == object else np.dtype(dtype)
+        schema[col] = [dtype.str, list(shape)]
+    return schema
+
+class FlightRecorder:
+    """ Records flight data into chunked columnar files:
+            <path>/<stream>/<chunk>/<column>.npy
+            <path>/<stream>/index.json
+            <path>/<stream>/columns.json
+        Chunks are written by a background thread, the index lists the time range
+        of every chunk so a FlightReader can load a time slice without reading the
+        whole flight. Streams 'state', 'commands' and 'detections' always exist,
+        more can be added with addStream.
+    """
+
+    def __init__(self, path: str, chunk_size: int=4096) -> None:
+        self.path = path
+        self.chunk_size = chunk_size
+        self.streams = {}
+        self.indexes = {}
+
+        self.flush_queue = queue.Queue()
+        self.flusher = threading.Thread(target=self.flushWorker, daemon=True)
+        self.closed = False
+
+        for name, columns in STREAMS.items():
+            self.addStream(name, columns)
+
+        self.flusher.start()
+
+    def addStream(self, name: str, columns: dict) -> ColumnStream:
+        if name in self.streams:
+            raise Exception(f"Stream {name} already exists.")
+        os.makedirs(os.path.join(self.path, name), exist_ok=True)
+        # lets a reader return typed empty columns for a stream without rows
+        with open(os.path.join(self.path, name, 'columns.json'), 'w') as f:
+            json.dump(getSchema(columns), f)
+        self.streams[name] = ColumnStream(name, columns, self.chunk_size)
+        self.indexes[name] = []
+        return self.streams[name]
+
+    def record(self, name: str, **row) -> None:
+        if self.closed:
+            return
+        chunk = self.streams[name].append(row)
+        if chunk is not None:
+            self.flush_queue.put((name,) + chunk)
+
+    def recordState(self, state: object) -> None:
+        row = {'t': state.timestamp, 'seq': state.seq}
+        for field in NUMERIC_STATE_FIELDS:
+            value = getattr(state, field, None)
+            row[field] = math.nan if value is None else value
+        self.record('state', **row)
+
+    def recordCommand(self, t: float, command: str, response: str, rtt: float) -> None:
+        self.record('commands', t=t, command=command, response=response, rtt=rtt)
+
+    def recordDetections(self, t: float, frame_seq: int, ids: list, rvecs: list, tvecs: list) -> None:
+        for i, marker_id in enumerate(ids):
+            self.record('detections', t=t, frame_seq=frame_seq, marker_id=marker_id,
+                        rvec=np.ravel(rvecs[i]), tvec=np.ravel(tvecs[i]))
+
+    def flushWorker(self) -> None:
+        while True:
+            item = self.flush_queue.get()
+            if item is None:
+                break
+            self.writeChunk(*item)
+
+    def writeChunk(self, name: str, chunk: int, buffers: dict, rows: int) -> None:
+        directory = os.path.join(self.path, name, f"{chunk:06d}")
+        os.makedirs(directory, exist_ok=True)
+        for col, values in buffers.items():
+            if values.dtype == object:
+                values = values[:rows].astype(str)
+            np.save(os.path.join(directory, f"{col}.npy"), values[:rows])
+
+        # the index is only updated once all columns are on disk
+        t = buffers['t'][:rows]
+        self.indexes[name].append({'chunk': chunk, 'rows': rows, 't_min': float(t.min()), 't_max': float(t.max())})
+        index_path = os.path.join(self.path, name, 'index.json')
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump(self.indexes[name], f)
+        os.replace(index_path + '.tmp', index_path)
+
+    def close(self) -> None:
+        """ Flush all partial chunks and stop the background writer.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        for name, stream in self.streams.items():
+            with stream.lock:
+                chunk = stream.take()
+            if chunk is not None:
+                self.flush_queue.put((name,) + chunk)
+        self.flush_queue.put(None)
+        self.flusher.join()
@@ -0,0 +1,55 @@
+import numpy as np
+from threading import Lock
+
+class ColumnStream:
+    """ Row appender for one recorded stream. Rows are written into preallocated
+        column buffers; a full chunk is handed out for flushing and replaced.
+        Every stream has a float64 time column 't'.
+    """
+
+    def __init__(self, name: str, columns: dict, chunk_size: int=4096) -> None:
+        if 't' not in columns:
+            raise Exception(f"Stream {name} needs a time column 't'.")
+
+        self.name = name
+        # column name -> (dtype, shape of one row)
+        self.columns = {col: spec if isinstance(spec, tuple) else (spec, ()) for col, spec in columns.items()}
+        self.chunk_size = chunk_size
+        self.chunk = 0
+        self.lock = Lock()
+        self.newBuffers()
+
+    def newBuffers(self) -> None:
+        self.buffers = {col: self.newBuffer(dtype, shape) for col, (dtype, shape) in self.columns.items()}
+        self.rows = 0
+
+    def newBuffer(self, dtype: object, shape: tuple) -> np.ndarray:
+        # object columns hold strings of any length, empty by default
+        if np.dtype(dtype) == object:
+            return np.full((self.chunk_size,) + shape, '', dtype=object)
+        return np.zeros((self.chunk_size,) + shape, dtype)
+
+    def append(self, row: dict) -> tuple | None:
+        """ Write one row. Missing columns keep their zero value.
+            Returns (chunk number, buffers, rows) when the chunk is full, else None.
+        """
+        with self.lock:
+            i = self.rows
+            for col, value in row.items():
+                self.buffers[col][i] = value
+            self.rows += 1
+
+            if self.rows == self.chunk_size:
+                return self.take()
+        return None
+
+    def take(self) -> tuple | None:
+        """ Hand out the current partial or full chunk and start a new one.
+            Must be called with the lock held.
+        """
+        if self.rows == 0:
+            return None
+        chunk = (self.chunk, self.buffers, self.rows)
+        self.chunk += 1
+        self.newBuffers()
+        return chunk
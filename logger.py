@@ -22,6 +22,9 @@ class Logger(object): #Object inheritence for child 'RospyLogger' (Jordy)
     def set_level(self, level):
         self.log_level = level
 
+    def enabled(self, level):
+        return self.log_level >= level
+
     def output(self, msg):
         self.lock.acquire()
         print(msg)
@@ -1,7 +1,6 @@
 import time
 import datetime
 import pygame
-import queue
 import threading
 import cv2
 import numpy as np
@@ -9,10 +8,13 @@ from lib.graph import Graph
 from lib.djitellopy import Tello
 from video_writer import WriteVideo
 from lib.aruco import Controller as arucoController
+from pipeline import Pipeline, DropQueue, SetpointMailbox
+from lib.recorder import FlightRecorder
 from pygame.locals import *
 
 S = 60
 FPS = 120
+QUEUE_SIZE = 2
 
 from config import CONFIG
 from lib.aruco.aruco_dict import ARUCO_DICT
@@ -26,6 +28,10 @@ BOARD_SQUARE_LENGTH = CONFIG['Aruco']['board_square_length']
 BOARD_MARKER_LENGTH = CONFIG['Aruco']['board_marker_length']
 
 S_PROG = CONFIG['Camera']['s_prog']
+RECORDER = CONFIG['Recorder']
+CONTROL_RATE = CONFIG['Control']['rate']
+SETPOINT_HOLD = CONFIG['Control']['setpoint_hold']
+SETPOINT_DECAY = CONFIG['Control']['setpoint_decay']
 
 board = cv2.aruco.CharucoBoard((BOARD_ROWS, BOARD_COLS), BOARD_SQUARE_LENGTH, BOARD_MARKER_LENGTH, ARUCO_TYPE)
 
@@ -65,8 +71,8 @@ class FrontEnd(object):
         self.battery = 0
         self.angles = [0., 0., 0., 0.]
 
-        self.dir_queue = queue.Queue()
-        self.dir_queue.queue.clear()
+        # newest directions from the controller, decaying to zero when they get old
+        self.setpoint = SetpointMailbox(SETPOINT_HOLD, SETPOINT_DECAY)
 
         # Bool variables for setting functions
         self.send_rc_control = False
@@ -78,74 +84,144 @@ class FrontEnd(object):
         self.navigate_event = threading.Event()
         self.navigate_event.clear()
 
-        self.arucoNav = arucoController(S_PROG, self.dir_queue, self.navigate_event)
-
-        # Create update timer
-        pygame.time.set_timer(USEREVENT + 1, 1000 // FPS)
+        self.arucoNav = arucoController(S_PROG, self.setpoint, self.navigate_event)
+
+        # Queues between the pipeline stages, full queues drop their oldest frame
+        self.detect_queue = DropQueue(QUEUE_SIZE)
+        self.render_queue = DropQueue(QUEUE_SIZE)
+        self.record_queue = DropQueue(QUEUE_SIZE)
+        self.display_queue = DropQueue(1)
+
+        self.frame_read = None
+        self.frame_seq = -1
+        self.pipeline = Pipeline()
+
+        # Flight recorder for state, commands and detections
+        self.recorder = None
+        if RECORDER['enabled']:
+            timestr = time.strftime("%Y%m%d_%H%M%S")
+            self.recorder = FlightRecorder(RECORDER['path'] + "/" + timestr, RECORDER['chunk_size'])
+            self.tello.set_flight_recorder(self.recorder)
+            self.arucoNav.recorder = self.recorder
+
+    def setupPipeline(self):
+        """ Create the decode, detect, control, render and record stages.
+            Control is ticked by its own scheduler at CONTROL_RATE and only reads the
+            newest directions, so rendering and recording can never delay the rc commands.
+        """
+        self.pipeline.addStage('decode', self.decodeStage, outboxes=[self.detect_queue])
+        self.pipeline.addStage('detect', self.detectStage, inbox=self.detect_queue, outboxes=[self.render_queue])
+        self.pipeline.addScheduler('control', self.update, CONTROL_RATE, on_error=self.hover)
+        self.pipeline.addStage('render', self.renderStage, inbox=self.render_queue, outboxes=[self.display_queue], nice=5)
+        self.pipeline.addStage('record', self.recordStage, inbox=self.record_queue, nice=10)
 
     def run(self):
 
-        self.tello.connect()
-        self.tello.set_speed(self.speed)
-
-        self.tello.streamoff()
-        self.tello.streamon()
-
-        frame_read = self.tello.get_frame_read()
-        directions = np.zeros(4)
-
-        time.sleep(3)
-
-        should_stop = False
-        while not should_stop:
-            frame=cv2.resize(frame_read.frame, (960,720))
-            for event in pygame.event.get():
-                if event.type == USEREVENT + 1:
-                    self.update(directions)
-                elif event.type == QUIT:
-                    should_stop = True
-                elif event.type == KEYDOWN:
-                    if event.key == K_ESCAPE:
-                        should_stop = True
-                    else:
-                        self.keydown(event.key)
-                elif event.type == KEYUP:
-                    self.keyup(event.key)
-
-            if frame_read.stopped:
-                frame_read.stop()
-                break
+        try:
+            self.tello.connect()
+            self.tello.set_speed(self.speed)
 
-            # Save image on 'M' press
-            if self.save:
-                timestr = time.strftime("%Y%m%d_%H%M%S")
-                cv2.imwrite("./images/"+timestr+".jpg", frame)
-                self.save = False
+            self.tello.streamoff()
+            self.tello.streamon()
 
-            if self.calibrate:
-                self.arucoNav.calibrate(frame)
-            
-            frame = self.arucoNav.detect(frame)
-
-            self.screen.fill([0, 0, 0])
-
-            text = "Battery: {}%".format(self.tello.get_battery())
-            cv2.putText(frame, text, (5, 720 - 5),
-                cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-            
-            frame=cv2.resize(frame, (640,480))
-
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            frame = np.rot90(frame)
-            frame = np.flipud(frame)
+            self.frame_read = self.tello.get_frame_read()
 
-            frame = pygame.surfarray.make_surface(frame)
-            self.screen.blit(frame, (0, 0))
-            pygame.display.update()
+            # Start as soon as the decoder delivers instead of sleeping a fixed time
+            if self.frame_read.wait_first_frame(Tello.FRAME_GRAB_TIMEOUT) is None:
+                print("No video frame received after {} seconds".format(Tello.FRAME_GRAB_TIMEOUT))
 
-            time.sleep(1 / FPS)
+            self.setupPipeline()
+            self.pipeline.start()
 
-        self.tello.end()
+            should_stop = False
+            while not should_stop:
+                for event in pygame.event.get():
+                    if event.type == QUIT:
+                        should_stop = True
+                    elif event.type == KEYDOWN:
+                        if event.key == K_ESCAPE:
+                            should_stop = True
+                        else:
+                            self.keydown(event.key)
+                    elif event.type == KEYUP:
+                        self.keyup(event.key)
+
+                if self.frame_read.stopped:
+                    self.frame_read.stop()
+                    break
+
+                # a stage stopped the pipeline after an unrecoverable error
+                if self.pipeline.isStopped():
+                    print("Pipeline stopped, ending the flight")
+                    break
+
+                # Wait for the render stage instead of sleeping a fixed time
+                frame = self.display_queue.get(timeout=1 / FPS)
+                if frame is None:
+                    continue
+
+                self.screen.fill([0, 0, 0])
+
+                frame = pygame.surfarray.make_surface(frame)
+                self.screen.blit(frame, (0, 0))
+                pygame.display.update()
+        finally:
+            # the recorder flushes its buffered rows even when the flight ends with an error
+            try:
+                self.pipeline.stop()
+                for name, stats in self.pipeline.stats().items():
+                    print("{}: {} items, mean {:.1f} ms, max {:.1f} ms, {} dropped, {} errors".format(
+                        name, stats['count'], stats['mean'] * 1000, stats['max'] * 1000, stats['dropped'], stats['errors']))
+                    if 'jitter_mean' in stats:
+                        print("{}: jitter mean {:.2f} ms, max {:.2f} ms, {} overruns, {} ticks skipped".format(
+                            name, stats['jitter_mean'] * 1000, stats['jitter_max'] * 1000, stats['overruns'], stats['skipped']))
+                print("setpoint: {} overwritten before they were sent".format(self.setpoint.overwritten))
+                self.tello.end()
+            finally:
+                if self.recorder is not None:
+                    self.recorder.close()
+
+    def decodeStage(self):
+        """ Wait for the next frame from the drone, so no frame is processed twice."""
+        newest = self.frame_read.wait_for_frame(self.frame_seq, timeout=0.1)
+        if newest is None:
+            return None
+        self.frame_seq, _, frame = newest
+
+        frame = cv2.resize(frame, (960,720))
+
+        # Save image on 'M' press
+        if self.save:
+            self.record_queue.put(frame.copy())
+            self.save = False
+
+        return self.frame_seq, frame
+
+    def detectStage(self, item):
+        """ Calibrate or detect markers, the controller publishes new directions itself."""
+        frame_seq, frame = item
+        if self.calibrate:
+            self.arucoNav.calibrate(frame)
+
+        return self.arucoNav.detect(frame, frame_seq)
+
+    def renderStage(self, frame):
+        """ Draw the overlay and convert the frame into the layout pygame expects."""
+        text = "Battery: {}%".format(self.tello.get_battery())
+        cv2.putText(frame, text, (5, 720 - 5),
+            cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+
+        frame=cv2.resize(frame, (640,480))
+
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        frame = np.rot90(frame)
+        frame = np.flipud(frame)
+        return frame
+
+    def recordStage(self, frame):
+        """ Write requested snapshots to disk."""
+        timestr = time.strftime("%Y%m%d_%H%M%S")
+        cv2.imwrite("./images/"+timestr+".jpg", frame)
 
     def keydown(self, key):
         """ Update velocities based on key pressed
@@ -204,14 +280,31 @@ class FrontEnd(object):
     def update(self):
         """ Update routine. Send velocities to Tello."""
         if self.send_rc_control:
-            if self.navigate_event.is_set() and not self.dir_queue.empty():
-                x, y, z, yaw = self.dir_queue.get()
+            directions = None
+            if self.navigate_event.is_set():
+                # filtered target predicted to now, the newest setpoint only while it is lost
+                directions = self.arucoNav.control(self.tello.get_current_state())
+                if directions is not None:
+                    self.setpoint.clear()
+                else:
+                    setpoint = self.setpoint.get()
+                    if setpoint is not None:
+                        directions = setpoint[0]
+
+            if directions is not None:
+                x, y, z, yaw = directions
                 self.tello.send_rc_control(int(x), int(y), int(z), int(yaw))
             else:
-                self.dir_queue.queue.clear()
+                self.setpoint.clear()
                 self.tello.send_rc_control(self.left_right_velocity, self.for_back_velocity, self.up_down_velocity,
                                         self.yaw_velocity)
     
+    def hover(self):
+        """ Stop all movement after a failed update, the next tick tries again."""
+        self.setpoint.clear()
+        if self.send_rc_control:
+            self.tello.send_rc_control(0, 0, 0, 0)
+
 def main() -> None:
     frontend = FrontEnd()
     frontend.run()
@@ -0,0 +1,305 @@
+import os
+import time
+import threading
+import traceback
+from collections import deque
+import logger
+
+LOGGER = logger.Logger('pipeline')
+
+class DropQueue():
+    """ Bounded queue that drops the oldest item when a new one does not fit.
+        Producers never block, so a slow consumer only ever sees recent items.
+    """
+
+    def __init__(self, maxsize=1):
+        self.items = deque(maxlen=maxsize)
+        self.cond = threading.Condition()
+        self.dropped = 0
+
+    def put(self, item):
+        with self.cond:
+            if len(self.items) == self.items.maxlen:
+                self.dropped += 1
+            self.items.append(item)
+            self.cond.notify()
+
+    def get(self, timeout=None):
+        """ Pop the oldest item, waiting up to timeout seconds.
+        Returns:
+            the item, or None when the queue stayed empty
+        """
+        with self.cond:
+            if not self.items and not self.cond.wait_for(lambda: self.items, timeout):
+                return None
+            return self.items.popleft()
+
+    def empty(self):
+        return not self.items
+
+    def clear(self):
+        with self.cond:
+            self.items.clear()
+
+class SetpointMailbox():
+    """ Single slot holding the newest setpoint, a write overwrites the previous one.
+        Every setpoint carries the perf_counter time it was written and the id of
+        its source. Readers get it scaled down linearly to zero once it is older
+        than hold seconds, reaching zero after another decay seconds, so a stalled
+        producer can never leave the drone executing an old command.
+    """
+
+    def __init__(self, hold, decay=0.):
+        self.hold = hold
+        self.decay = decay
+        self.lock = threading.Lock()
+        self.value = None
+        self.timestamp = None
+        self.source = None
+        # setpoints replaced before anyone read them
+        self.overwritten = 0
+        self.unread = False
+
+    def put(self, value, source=None):
+        with self.lock:
+            if self.unread:
+                self.overwritten += 1
+            self.value = list(value)
+            self.timestamp = time.perf_counter()
+            self.source = source
+            self.unread = True
+
+    def age(self, now=None):
+        """ Seconds since the setpoint was written, None when there is none.
+        """
+        with self.lock:
+            if self.timestamp is None:
+                return None
+            return (time.perf_counter() if now is None else now) - self.timestamp
+
+    def getScale(self, age):
+        if age <= self.hold:
+            return 1.
+        if self.decay <= 0:
+            return 0.
+        return max(0., 1. - (age - self.hold) / self.decay)
+
+    def get(self, now=None):
+        """ Newest setpoint with its age applied.
+        Returns:
+            (value, source, age), or None when nothing was written since the last clear
+        """
+        with self.lock:
+            if self.value is None:
+                return None
+            age = (time.perf_counter() if now is None else now) - self.timestamp
+            scale = self.getScale(age)
+            self.unread = False
+            return [v * scale for v in self.value], self.source, age
+
+    def clear(self):
+        with self.lock:
+            self.value = None
+            self.timestamp = None
+            self.source = None
+            self.unread = False
+
+class StageStats():
+    """ Timing counters of a single pipeline stage, all times in seconds.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.total = 0.
+        self.last = 0.
+        self.max = 0.
+        # calls that raised
+        self.errors = 0
+
+    def add(self, duration):
+        with self.lock:
+            self.count += 1
+            self.total += duration
+            self.last = duration
+            self.max = max(self.max, duration)
+
+    def addError(self):
+        with self.lock:
+            self.errors += 1
+
+    def snapshot(self):
+        with self.lock:
+            mean = self.total / self.count if self.count else 0.
+            return {'count': self.count, 'mean': mean, 'last': self.last, 'max': self.max, 'errors': self.errors}
+
+class Stage():
+    """ One pipeline stage running func in its own thread.
+        Without an inbox func() is a source and is called in a loop, optionally every period seconds.
+        With an inbox func(item) is called for every item. Results other than None are put in all outboxes.
+    """
+
+    def __init__(self, name, func, stop_event, inbox=None, outboxes=(), period=None, nice=0):
+        self.name = name
+        self.func = func
+        self.stop_event = stop_event
+        self.inbox = inbox
+        self.outboxes = list(outboxes)
+        self.period = period
+        self.nice = nice
+        self.stats = StageStats()
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def setNice(self):
+        # Linux applies niceness per thread, elsewhere this is best effort
+        if self.nice == 0:
+            return
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.nice)
+        except (AttributeError, OSError):
+            pass
+
+    def run(self):
+        self.setNice()
+
+        while not self.stop_event.is_set():
+            if self.inbox is not None:
+                item = self.inbox.get(timeout=0.1)
+                if item is None:
+                    continue
+
+            start = time.perf_counter()
+            try:
+                result = self.func(item) if self.inbox is not None else self.func()
+            except Exception:
+                # drop the item and keep the stage running
+                result = None
+                self.logError()
+            duration = time.perf_counter() - start
+            self.stats.add(duration)
+
+            if result is not None:
+                for outbox in self.outboxes:
+                    outbox.put(result)
+
+            if self.period is not None and duration < self.period:
+                time.sleep(self.period - duration)
+
+    def logError(self):
+        self.stats.addError()
+        LOGGER.error("Stage {} failed:\n{}".format(self.name, traceback.format_exc()))
+
+    def snapshot(self):
+        """ Timing and error counters, how many items were dropped from the inbox
+            and whether the thread still runs.
+        """
+        stats = self.stats.snapshot()
+        stats['dropped'] = self.inbox.dropped if self.inbox is not None else 0
+        stats['alive'] = self.thread.is_alive()
+        return stats
+
+class ControlScheduler(Stage):
+    """ Stage calling func() at a fixed rate. Ticks are scheduled on absolute
+        perf_counter deadlines, so a late tick does not shift the ones after it.
+        Ticks whose deadline passed while func was still running are skipped
+        rather than run back to back. When func raises, on_error() is called to
+        bring the drone into a safe state, without it or when it fails as well
+        the whole pipeline is stopped.
+    """
+
+    def __init__(self, name, func, stop_event, rate, nice=0, on_error=None):
+        super().__init__(name, func, stop_event, period=1. / rate, nice=nice)
+        self.on_error = on_error
+        # lateness of every tick
+        self.jitter = StageStats()
+        self.overruns = 0
+        self.skipped = 0
+
+    def run(self):
+        self.setNice()
+
+        deadline = time.perf_counter()
+        while not self.stop_event.is_set():
+            delay = deadline - time.perf_counter()
+            if delay > 0 and self.stop_event.wait(delay):
+                break
+
+            start = time.perf_counter()
+            self.jitter.add(start - deadline)
+            try:
+                self.func()
+            except Exception:
+                self.logError()
+                self.recover()
+            end = time.perf_counter()
+            self.stats.add(end - start)
+
+            deadline += self.period
+            if end > deadline:
+                # func overran into the next tick, continue at the next deadline ahead
+                self.overruns += 1
+                missed = int((end - deadline) // self.period) + 1
+                self.skipped += missed
+                deadline += missed * self.period
+
+    def recover(self):
+        if self.on_error is not None:
+            try:
+                self.on_error()
+                return
+            except Exception:
+                LOGGER.error("Stage {} could not recover:\n{}".format(self.name, traceback.format_exc()))
+        self.stop_event.set()
+
+    def snapshot(self):
+        stats = super().snapshot()
+        jitter = self.jitter.snapshot()
+        stats['jitter_mean'] = jitter['mean']
+        stats['jitter_max'] = jitter['max']
+        stats['overruns'] = self.overruns
+        stats['skipped'] = self.skipped
+        return stats
+
+class Pipeline():
+    """ A set of stages connected by DropQueues, started and stopped together.
+    """
+
+    def __init__(self):
+        self.stages = []
+        self.stop_event = threading.Event()
+
+    def addStage(self, name, func, inbox=None, outboxes=(), period=None, nice=0):
+        stage = Stage(name, func, self.stop_event, inbox, outboxes, period, nice)
+        self.stages.append(stage)
+        return stage
+
+    def addScheduler(self, name, func, rate, nice=0, on_error=None):
+        scheduler = ControlScheduler(name, func, self.stop_event, rate, nice, on_error)
+        self.stages.append(scheduler)
+        return scheduler
+
+    def start(self):
+        self.stop_event.clear()
+        for stage in self.stages:
+            stage.start()
+
+    def isStopped(self):
+        return self.stop_event.is_set()
+
+    def stop(self, timeout=1.):
+        self.stop_event.set()
+        for stage in self.stages:
+            # also safe when start failed or was never called
+            if stage.thread.is_alive():
+                stage.thread.join(timeout)
+
+    def stats(self):
+        """ Per stage timing counters, including how many items were dropped from its inbox.
+        """
+        stats = {}
+        for stage in self.stages:
+            stats[stage.name] = stage.snapshot()
+        return stats
@@ -9,6 +9,7 @@ from lib.graph import Graph
 from lib.djitellopy import Tello
 from video_writer import WriteVideo
 from lib.aruco import Controller as arucoController
+from pipeline import SetpointMailbox
 from pygame.locals import *
 
 S = 60
@@ -75,10 +76,9 @@ class FrontEnd(object):
         self.navigate_event = threading.Event()
         self.navigate_event.clear()
 
-        self.dir_queue = queue.Queue()
-        self.dir_queue.queue.clear()
+        self.setpoint = SetpointMailbox(CONFIG['Control']['setpoint_hold'], CONFIG['Control']['setpoint_decay'])
 
-        self.arucoNav = arucoController(15, self.dir_queue, self.navigate_event)
+        self.arucoNav = arucoController(15, self.setpoint, self.navigate_event)
 
         # Create update timer
         pygame.time.set_timer(USEREVENT + 1, 1000 // FPS)